@@ -1,217 +1,352 @@
 import os
-import requests
-import imgkit
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
+import time
 from datetime import datetime
+from flask import Flask, Response, request, jsonify
+from job_queue import JobQueue
+from delivery_ledger import DeliveryLedger
+from telegram_client import TelegramClient
+from send_scheduler import SendScheduler
+from fanout import fan_out_futures
+from image_encoding import ImageEncoder
+from metrics import CONTENT_TYPE, Registry
+import structured_log
+from structured_log import get_logger
+from receipt_batch import render_receipts
+from renderers import create_renderer
+from warmup import Warmup
+from loyverse_client import LoyverseClient
+from reconciler import Reconciler
+from reference_data import ReferenceData
+from receipt_template import ReceiptTemplate
+from assets import assets
+from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+log = get_logger("app")
+
+# Fraction of webhooks whose full payload is logged (receipt numbers always are)
+LOG_PAYLOAD_SAMPLE = float(os.getenv("LOG_PAYLOAD_SAMPLE", "0.1"))
+
 # Loyverse and Telegram API tokens
 LOYVERSE_ACCESS_TOKEN = os.getenv("LOYVERSE_ACCESS_TOKEN")
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-BASE_URL = "https://api.loyverse.com/v1.0"
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")  # Telegram chat ID to send the image >
+# Every chat that gets each receipt (comma-separated); defaults to TELEGRAM_CHAT_ID
+TELEGRAM_CHAT_IDS = [
+    chat_id.strip() for chat_id in os.getenv("TELEGRAM_CHAT_IDS", TELEGRAM_CHAT_ID or "").split(",") if chat_id.strip()
+]
+# Store logo (RECEIPT_LOGO), fetched once into the local asset cache
+LOGO_URL = os.getenv(
+    "RECEIPT_LOGO",
+    "https://data-prod-eu-loyverse-com.s3.amazonaws.com/outlets/3279808/profile/emailLogo2024-07-23-09-19-35-035.png",
+)
+
+# Receipt HTML template, loaded and compiled once (hot-reloads on change).
+# The logo and Roboto come from the local asset cache and are inlined, so
+# wkhtmltoimage never has to fetch anything while rendering; if they could not
+# be downloaded at boot, the template is recompiled once the background retry
+# (started by warm-up) gets them.
+receipt_template = ReceiptTemplate(constants=lambda: {
+    "logo_src": assets.logo_src(LOGO_URL),
+    "font_css": assets.font_css(),
+})
+
+# Receipt renderer: "wkhtmltoimage" (imgkit), "pyppeteer" (pooled Chromium),
+# "node" (screenshot.js) or "native" (Pillow, no browser); only the chosen
+# backend's dependencies are imported
+RECEIPT_RENDERER = os.getenv("RECEIPT_RENDERER", "wkhtmltoimage")
+renderer = create_renderer(RECEIPT_RENDERER, receipt_template)
+
+# Dedupe ledger so Loyverse retries never post the same receipt twice
+LEDGER_PATH = os.getenv("LEDGER_PATH", "deliveries.db")
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "30"))
+ledger = DeliveryLedger(LEDGER_PATH, retention_days=LEDGER_RETENTION_DAYS)
+
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    "receipt_stage_seconds", "Seconds spent in each stage of getting a receipt to Telegram", ["stage"]
+)
+# From the sale (the receipt's created_at) to Telegram acknowledging the last
+# chat; includes POS sync delays, so the buckets run to an hour
+end_to_end_seconds = metrics.histogram(
+    "receipt_end_to_end_seconds", "Seconds from a receipt's created_at to Telegram's acknowledgement",
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600),
+)
+receipt_outcomes = metrics.counter("receipts_total", "Receipts handled, by outcome", ["outcome"])
+telegram_requests = metrics.counter("telegram_requests_total", "Telegram Bot API requests, by method and status",
+                                    ["method", "status"])
+
+# Background render/delivery queue
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "1"))
+RENDER_CONCURRENCY = int(os.getenv("RENDER_CONCURRENCY", "4"))  # Receipts of one payload rendered at once
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "100"))
+render_queue = JobQueue(workers=RENDER_WORKERS, maxsize=RENDER_QUEUE_SIZE, name="render",
+                        on_finish=lambda wait, latency, ok: stage_seconds.observe(wait, "queue_wait"))
+
+# Format of the uploaded image: png, webp or jpeg, optionally palette-reduced
+# (RECEIPT_COLORS, PNG only) or held to a byte budget (RECEIPT_MAX_BYTES).
+# Renderers that capture the whole page have the image cropped to the receipt.
+RECEIPT_FORMAT = os.getenv("RECEIPT_FORMAT", "png")
+RECEIPT_COLORS = int(os.getenv("RECEIPT_COLORS", "0")) or None
+RECEIPT_QUALITY = int(os.getenv("RECEIPT_QUALITY", "85"))
+RECEIPT_MAX_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", "0")) or None
+encoder = ImageEncoder(RECEIPT_FORMAT, colors=RECEIPT_COLORS, quality=RECEIPT_QUALITY,
+                       max_bytes=RECEIPT_MAX_BYTES, crop=renderer.crops)
+
+# Pooled Telegram client (keep-alive, concurrent uploads, 429-aware retries)
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "8"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "4"))
+telegram = TelegramClient(BOT_TOKEN, pool_size=TELEGRAM_POOL_SIZE, max_retries=TELEGRAM_MAX_RETRIES)
+
+def _telegram_request(method, seconds, status):
+    stage_seconds.observe(seconds, "upload")
+    telegram_requests.inc(method, status)
+
+telegram.on_request = _telegram_request
+
+# Sends are paced by per-chat and bot-wide token buckets; the limits are
+# shared out between gunicorn workers
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "20"))      # messages per minute per chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # messages per second overall
+# Seconds to gather receipts into one album of up to 10; unset sends them one by one
+TELEGRAM_ALBUM_WINDOW = os.getenv("TELEGRAM_ALBUM_WINDOW")
+sender = SendScheduler(
+    telegram,
+    chat_rate=TELEGRAM_CHAT_RATE / 60 / WEB_CONCURRENCY,
+    global_rate=TELEGRAM_GLOBAL_RATE / WEB_CONCURRENCY,
+    album_window=float(TELEGRAM_ALBUM_WINDOW) if TELEGRAM_ALBUM_WINDOW else None,
+)
+
+metrics.gauge("render_queue_depth", "Payloads waiting for a render worker", lambda: render_queue.stats()["depth"])
+metrics.gauge("send_queue_depth", "Telegram sends waiting for a rate-limit token", lambda: sender.stats()["queued"])
+metrics.gauge("log_records_dropped", "Log records dropped because the log queue was full", structured_log.dropped)
+
 # Flask application
 app = Flask(__name__)
 
-# No longer used because we rely on webhook data.
-def get_latest_receipt():
-    url = f"{BASE_URL}/receipts?limit=1&order_by=-created_at"
-    headers = {"Authorization": f"Bearer {LOYVERSE_ACCESS_TOKEN}"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        receipts = response.json().get("receipts", [])
-        return receipts[0] if receipts else None
-    else:
-        print(f"Error fetching receipt: {response.status_code}, {response.text}")
+# Employee, store and payment-type names for receipts, bulk-fetched from
+# Loyverse at startup and refreshed every REFERENCE_TTL seconds in the
+# background (REFERENCE_DATA=0 prints the raw ids instead). Renders only read
+# memory; an id not seen yet costs one quick, single-flight lookup.
+REFERENCE_DATA = os.getenv("REFERENCE_DATA", "1") != "0"
+REFERENCE_TTL = float(os.getenv("REFERENCE_TTL", "3600"))
+reference = ReferenceData(LoyverseClient(LOYVERSE_ACCESS_TOKEN, pool_size=2, max_retries=1, timeout=(3, 5)),
+                          ttl=REFERENCE_TTL)
+if REFERENCE_DATA:
+    reference.start()
+
+# Render and encode one receipt (runs in the render pool)
+def render_receipt(receipt_data):
+    with stage_seconds.time("build"):
+        if REFERENCE_DATA:
+            receipt_data = reference.annotate(receipt_data)
+        built = renderer.build(receipt_data)
+    with stage_seconds.time("rasterize"):
+        image = renderer.rasterize(built)
+    if image is None:
         return None
+    with stage_seconds.time("encode"):
+        data = encoder.encode(image)
+    # Per-receipt sizes; bytes_in is None for a Pillow image, which has no size before encoding
+    log.info("receipt_encoded", receipt_number=receipt_data.get("receipt_number", "N/A"), format=encoder.format,
+             bytes_in=len(image) if isinstance(image, bytes) else None, bytes_out=len(data))
+    return data
+
+# Warm-up at worker start (WARMUP=0 to skip): cache the logo and fonts, launch
+# the renderer, render and encode a dummy receipt, start the render queue and
+# open the Telegram connection, so the first sale after a restart is not the
+# slow one. /readyz answers 503 until the required steps are done.
+WARMUP = os.getenv("WARMUP", "1") != "0"
+WARMUP_RECEIPT = {
+    "receipt_number": "warm-up",
+    "total_money": 1.0,
+    "line_items": [{"item_name": "Warm-up", "quantity": 1, "price": 1.0}],
+    "payments": [{"name": "Transfer", "money_amount": 1.0}],
+}
+
+# Download the logo and Roboto; whatever fails is retried in the background
+def _warm_assets():
+    if assets.preload([LOGO_URL]):
+        return True
+    assets.start_retries([LOGO_URL])
+    return False
+
+# Kept out of the stage metrics and never sent
+def _warm_render():
+    image = renderer.render(WARMUP_RECEIPT)
+    return image is not None and encoder.encode(image) is not None
+
+warmup = Warmup([
+    ("assets", _warm_assets, False),
+    ("renderer", renderer.start, True),
+    ("render", _warm_render, True),
+    ("render_queue", render_queue.start, True),
+    ("telegram", telegram.warm_up, False),
+], enabled=WARMUP)
+warmup.start()
+metrics.gauge("worker_ready", "1 once warm-up has finished", lambda: int(warmup.ready))
+
+# Unix time of a receipt's created_at ("2025-02-06T08:37:43.000Z"), or None
+def _created_at(receipt_data):
+    try:
+        return datetime.fromisoformat(receipt_data["created_at"].replace("Z", "+00:00")).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return None
+
+# Render every receipt of a payload in parallel and hand the images to the
+# send scheduler (runs on a render queue worker). The worker does not wait
+# for Telegram: each receipt's outcome is recorded by a callback once its
+# last chat has answered, so rate-limited sends can collect into albums
+# while the worker moves on to the next payload.
+def process_receipts(receipts, received_at=None):
+    created_at = {receipt_data.get("receipt_number", "N/A"): _created_at(receipt_data) for receipt_data in receipts}
+    results = render_receipts(receipts, render_receipt, RENDER_CONCURRENCY)
+    rendered = []
+    for result in results:
+        receipt_number = result["receipt_number"]
+        if not result["ok"]:
+            # Let a later retry have another go
+            ledger.release(receipt_number)
+            receipt_outcomes.inc("render_failed")
+            log.error("receipt_not_rendered", receipt_number=receipt_number, error=result["error"])
+            continue
+        ledger.mark_rendered(receipt_number)
+        rendered.append(result)
+
+    # Chats each receipt still has to reach (an earlier attempt may have got some)
+    targets = []
+    for result in rendered:
+        delivered = ledger.delivered_chats(result["receipt_number"])
+        targets.append([chat_id for chat_id in TELEGRAM_CHAT_IDS if chat_id not in delivered])
 
-# Function to generate a receipt image
-def generate_receipt_image(receipt_data):
-    # HTML template for the receipt
-    html_template = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Receipt - Chic Opulance</title>
-        <link href="https://fonts.googleapis.com/css?family=Roboto" rel="stylesheet">
-        <style>
-            body {
-                font-family: 'Roboto', sans-serif;
-                background-color: #F5F5F5;
-                margin: 0;
-                padding: 20px;
-                display: flex;
-                justify-content: center;
-            }
-            .receipt {
-                background: #ffffff;
-                padding: 20px;
-                border-radius: 8px;
-                max-width: 400px;
-                width: 100%;
-                box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-            }
-            .logo {
-                display: block;
-                margin: 0 auto 10px;
-                height: 80px;
-            }
-            h1, p {
-                text-align: center;
-                margin: 5px 0;
-            }
-            h2 {
-                text-align: center;
-                margin: 5px 0;
-                font-size: 15px;
-                font-weight: bold;  
-            }
-            hr {
-               color: #666;
-                border-top: 1px dotted #aaa;    
-              
-            }
-            .total {
-                font-size: 24px;
-                font-weight: bold;
-            }
-            .item {
-                display: flex;
-                justify-content: space-between;
-                padding: 5px 0;
-            }
-            .footer {
-                text-align: center;
-                font-size: 14px;
-                color: #666;
-            }
-            .footer-inline {
-                display: flex;
-                justify-content: space-between;
-                font-size: 14px;
-                color: #666;
-                margin-bottom: 5px;  
-            }
-            .total-text{
-              color: #666;
-              padding-bottom: 5px;
-            }
-            .footer-bottom{
-               text-align: center;
-                font-size: 10px;
-                color: #666;
-            }
-        </style>
-        
-    </head>
-    <body>
-        <div class="receipt">
-            <img class="logo" src="https://data-prod-eu-loyverse-com.s3.amazonaws.com/outlets/3279808/profile/emailLogo2024-07-23-09-19-35-035.png" alt="Chic Opulance">
-            <h2>Chic Opulance</h2>
-            <hr>
-            <p class="total">MVR {total_amount:.2f}</p>
-            <p class="total-text">Total</p>
-            <hr>
-            <div>
-             <span class="footer-inline">Employee: {employee_id}</span>
-             <span class="footer-inline">POS:{store_id}</span>
-            </div>
-           
-            <hr>
-            
-            {line_items_html}
-            <hr>
-
-            <div class="item">
-                <strong>Total</strong>
-                <strong>MVR {total_amount:.2f}</strong>
-            </div>
-            
-            <div class="item">
-                <span>Transfer</span>
-                <span>MVR {total_amount:.2f}</span>
-            </div>
-            
-            <hr>
-            <p class="footer">Thank You!<br>BML Transfer: 7730000465147<br>Account Name: SM Shop<br>Viber/Telegram: 7620064</p>
-            <div class="footer-inline">
-                <span>{server_time}</span>
-                <span>Receipt № {receipt_number}</span>
-            </div>
-            <p class="footer-bottom"> made by @shahulyns.bot❤️</p>
-        </div>
-    </body>
-    </html>
-    """
-
-    # Generate line items HTML
-    line_items_html = ""
-    for item in receipt_data.get("line_items", []):
-        item_name = item.get("item_name", "Item")
-        quantity = item.get("quantity", 0)
-        unit_price = item.get("price", 0)
-        line_total = quantity * unit_price
-        line_items_html += f"""
-        <div class="item">
-            <span>{item_name}</span>
-            <span>MVR {line_total:.2f}</span>   
-        </div>
-        <span class="footer-inline">{quantity} × MVR {unit_price:.2f}</span>
-        """
-
-    # Fill in the template with actual data
-    receipt_html = html_template.format(
-        receipt_number=receipt_data.get("receipt_number", "N/A"),
-        store_id=receipt_data.get("store_id", "N/A"),
-        employee_id=receipt_data.get("employee_id", "N/A"),
-        server_time=datetime.now().strftime("%d/%m/%Y %H:%M"),
-        line_items_html=line_items_html,
-        total_amount=receipt_data.get("total_money", 0)
+    # Each image is uploaded once and re-sent by file_id to the other chats
+    delivery_started = time.perf_counter()
+    futures = fan_out_futures(
+        sender,
+        [result["image"] for result in rendered],
+        targets,
+        captions=[f"Receipt № {result['receipt_number']}" for result in rendered],
+        mime=encoder.mime,
     )
+    for result, future in zip(rendered, futures):
+        receipt_number = result["receipt_number"]
+        future.add_done_callback(
+            lambda future, receipt_number=receipt_number: _record_delivery(
+                receipt_number, future.result(), delivery_started,
+                created_at.get(receipt_number), received_at)
+        )
 
-    # Save the HTML and convert to image
-    html_path = "/tmp/receipt.html"
-    img_path = "/tmp/receipt.png"
-    with open(html_path, "w") as file:
-        file.write(receipt_html)
-    
-    imgkit.from_file(html_path, img_path)
-    return img_path
-
-# Function to send the generated image to Telegram
-def send_telegram_image(chat_id, img_path):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
-    with open(img_path, "rb") as photo:
-        response = requests.post(url, files={"photo": photo}, data={"chat_id": chat_id})
-    if response.status_code == 200:
-        print(f"Image sent successfully to chat ID {chat_id}")
-    else:
-        print(f"Failed to send image: {response.status_code}, {response.text}")
+# Ledger, metrics and log for one receipt once every chat has answered
+# (runs on a send thread)
+def _record_delivery(receipt_number, outcome, delivery_started, created_at, received_at):
+    stage_seconds.observe(time.perf_counter() - delivery_started, "deliver")
+    for chat_id, ok in outcome.items():
+        if ok:
+            ledger.mark_chat_delivered(receipt_number, chat_id)
+    failed = [chat_id for chat_id, ok in outcome.items() if not ok]
+    if failed:
+        ledger.release(receipt_number)
+        receipt_outcomes.inc("send_failed")
+        log.error("receipt_not_delivered", receipt_number=receipt_number, chats=failed)
+        return
+    ledger.mark_delivered(receipt_number)
+    receipt_outcomes.inc("delivered")
+    if created_at is not None:
+        end_to_end_seconds.observe(max(0.0, time.time() - created_at))
+    if received_at is not None:
+        # Webhook arrival (or reconciler pick-up) to the last chat having it
+        stage_seconds.observe(time.monotonic() - received_at, "since_webhook")
+
+# Missed-webhook reconciliation (RECONCILE=0 to turn off): one worker at a
+# time polls Loyverse for receipts the ledger never saw and queues them like
+# a webhook would. Polls every RECONCILE_OPEN_INTERVAL seconds during
+# STORE_HOURS (local time, e.g. "09:00-23:00"; unset means always open) and
+# up to RECONCILE_CLOSED_INTERVAL seconds apart outside them.
+RECONCILE = os.getenv("RECONCILE", "1") != "0"
+STORE_HOURS = os.getenv("STORE_HOURS")
+loyverse = LoyverseClient(LOYVERSE_ACCESS_TOKEN, pool_size=1)
+
+def _submit_missed(receipts):
+    if not render_queue.submit(process_receipts, receipts, time.monotonic()):
+        return False
+    receipt_outcomes.inc("reconciled", amount=len(receipts))
+    return True
+
+reconciler = Reconciler(
+    loyverse, ledger, _submit_missed,
+    open_hours=STORE_HOURS,
+    open_interval=float(os.getenv("RECONCILE_OPEN_INTERVAL", "60")),
+    closed_interval=float(os.getenv("RECONCILE_CLOSED_INTERVAL", "900")),
+    grace=float(os.getenv("RECONCILE_GRACE", "120")),
+    overlap=float(os.getenv("RECONCILE_OVERLAP", "3600")),
+    lookback=float(os.getenv("RECONCILE_LOOKBACK", "0")),
+)
+if RECONCILE:
+    reconciler.start()
 
 # Webhook endpoint to handle new sales events
 @app.route("/webhook", methods=["POST"])
 def handle_webhook():
-    data = request.json
-    print("Webhook received data:", data)
+    received_at = time.monotonic()
+    with stage_seconds.time("parse"):
+        data = request.get_json()
 
-    # Extract receipt data from the webhook payload.
-    # The payload contains a key 'receipts' which is a list.
-    receipts = data.get("receipts")
+        # Extract receipt data from the webhook payload.
+        # The payload contains a key 'receipts' which is a list.
+        receipts = data.get("receipts")
+    log.info("webhook_received", receipts=[receipt.get("receipt_number") for receipt in receipts or []])
+    log.info("webhook_payload", sample=LOG_PAYLOAD_SAMPLE, payload=data)
     if receipts and len(receipts) > 0:
-        receipt_data = receipts[0]
-        img_path = generate_receipt_image(receipt_data)
-        send_telegram_image(TELEGRAM_CHAT_ID, img_path)
-        os.remove(img_path)  # Clean up the temporary image
+        # Drop receipts already rendered or delivered before any work is queued
+        fresh = ledger.claim_new(receipts)
+        if len(fresh) < len(receipts):
+            receipt_outcomes.inc("duplicate", amount=len(receipts) - len(fresh))
+        receipts = fresh
+        # Acknowledge straight away; a worker renders and sends in the background
+        if receipts and not render_queue.submit(process_receipts, receipts, received_at):
+            ledger.release_all(receipts)
+            receipt_outcomes.inc("rejected", amount=len(receipts))
+            log.warning("render_queue_full", receipts=len(receipts))
+            return jsonify({"status": "busy"}), 503
     else:
-        print("No receipt data found.")
+        log.info("webhook_without_receipts")
 
     return jsonify({"status": "ok"}), 200
 
+# Render queue depth and job latency, plus Telegram upload, encoding and reconciler state
+@app.route("/queue", methods=["GET"])
+def queue_stats():
+    return jsonify({**render_queue.stats(), "telegram": telegram.stats(), "sender": sender.stats(),
+                    "encoding": encoder.stats(), "renderer": renderer.stats(),
+                    "reconciler": reconciler.stats(), "reference_data": reference.stats()}), 200
+
+# Liveness: the worker is up and answering
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok", "ready": warmup.ready, "worker": os.getpid()}), 200
+
+# Readiness: 503 until warm-up has finished, plus renderer and queue state
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    status = warmup.status()
+    body = {
+        "ready": status["ready"],
+        "warmup": status,
+        "renderer": renderer.stats(),
+        "render_queue": render_queue.stats(),
+        "sender": sender.stats(),
+    }
+    return jsonify(body), 200 if status["ready"] else 503
+
+# Per-stage latency histograms and outcome counters in Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 # Start the Flask application
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
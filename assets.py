@@ -0,0 +1,177 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+from structured_log import get_logger
+
+log = get_logger("assets")
+
+# Local copies of everything a receipt render used to fetch over the network:
+# the store logo from the Loyverse S3 bucket and the Roboto font from Google
+# Fonts. Files are downloaded once into ASSET_DIR (or dropped there by hand)
+# and handed to the renderers as local paths or inline data: URIs. Renders
+# only ever read what is already on disk: downloads happen in preload()
+# (warm-up) and, for anything that failed, in a background thread started by
+# start_retries() that tries again every RETRY_AFTER seconds until it has
+# everything. Until then the original URL is returned and the renderer
+# behaves as before; `version` goes up whenever something new is cached, so
+# callers holding on to fallbacks know to look again.
+ASSET_DIR = os.getenv("ASSET_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"))
+FONT_CSS_URL = "https://fonts.googleapis.com/css?family=Roboto:400,700"
+FONT_FILES = {False: "Roboto-Regular.ttf", True: "Roboto-Bold.ttf"}
+LOGO_HEIGHT = 160  # 2x the 80px CSS height, so zoomed renders stay sharp
+RETRY_AFTER = 300  # seconds before a failed download is tried again
+
+_FONT_FACE = re.compile(r"@font-face\s*{[^}]*?font-weight:\s*(\d+);[^}]*?url\(([^)]+)\)", re.S)
+
+def _download(url):
+    import requests
+    response = requests.get(url, timeout=15)
+    response.raise_for_status()
+    return response.content
+
+def _data_uri(data, mime):
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+class AssetManager:
+    def __init__(self, directory=ASSET_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._key_locks = {}
+        self._logo_urls = set()
+        self._retry_pid = None
+        self.version = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Return the file's bytes, fetching it first if it is not on disk yet;
+    # without fetch a missing file raises FileNotFoundError
+    def _file(self, name, fetch=None):
+        path = self._path(name)
+        if not os.path.exists(path) and fetch is not None:
+            data = fetch()
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        with open(path, "rb") as file:
+            return file.read()
+
+    # Memoise func() under key, or None if it fails (a missing file is not
+    # worth a warning; failed downloads are). Each key has its own lock, so a
+    # slow download only holds up callers waiting for that same asset, and
+    # with wait=False (renders) not even those: they get None straight away.
+    def _memo(self, key, func, wait=True):
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if not key_lock.acquire(blocking=wait):
+            return None
+        try:
+            with self._lock:
+                if key in self._cache:
+                    return self._cache[key]
+            try:
+                value = func()
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                log.warning("asset_unavailable", asset=key, error=str(e))
+                return None
+            with self._lock:
+                self._cache[key] = value
+                self.version += 1
+            return value
+        finally:
+            key_lock.release()
+
+    def _logo_name(self, url, height):
+        return f"logo-{hashlib.sha1(url.encode()).hexdigest()[:12]}-{height}.png"
+
+    # Logo pre-sized to `height` pixels, as PNG bytes; None until it is on disk
+    # (download=True fetches it if it is not)
+    def logo_png(self, url, height=LOGO_HEIGHT, download=False):
+        name = self._logo_name(url, height)
+        fetch = (lambda: self._resize_logo(_download(url), height)) if download else None
+        return self._memo(name, lambda: self._file(name, fetch), wait=download)
+
+    def _resize_logo(self, data, height):
+        try:
+            from PIL import Image
+        except ImportError:
+            return data
+        image = Image.open(io.BytesIO(data)).convert("RGBA")
+        width = max(1, round(image.width * height / image.height))
+        buffer = io.BytesIO()
+        image.resize((width, height), Image.LANCZOS).save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue()
+
+    # Value for an <img src>: inline data URI, or the original URL as a fallback
+    def logo_src(self, url, height=LOGO_HEIGHT):
+        if self.logo_png(url, height) is None:
+            return url
+        name = self._logo_name(url, height)
+        return self._memo(f"{name}.uri", lambda: _data_uri(self._cache[name], "image/png"))
+
+    # Roboto TTF links from Google's CSS (plain clients are served TTF, not WOFF2)
+    def _font_urls(self):
+        css = _download(FONT_CSS_URL).decode("utf-8")
+        urls = {int(weight): url.strip("'\"") for weight, url in _FONT_FACE.findall(css)}
+        return {False: urls[400], True: urls[700]}
+
+    def font(self, bold=False, download=False):
+        name = FONT_FILES[bold]
+        fetch = (lambda: _download(self._font_urls()[bold])) if download else None
+        return self._memo(name, lambda: self._file(name, fetch), wait=download)
+
+    def font_path(self, bold=False):
+        return self._path(FONT_FILES[bold]) if self.font(bold) is not None else None
+
+    # <style> with Roboto inlined, replacing the Google Fonts <link>
+    def font_css(self):
+        if self.font(False) is None or self.font(True) is None:
+            return f'<link href="{FONT_CSS_URL}" rel="stylesheet">'
+        return self._memo("font.css", self._build_font_css)
+
+    def _build_font_css(self):
+        regular, bold = self._cache[FONT_FILES[False]], self._cache[FONT_FILES[True]]
+        faces = []
+        for weight, data in ((400, regular), (700, bold)):
+            faces.append(
+                "@font-face { font-family: 'Roboto'; font-style: normal; "
+                f"font-weight: {weight}; src: url({_data_uri(data, 'font/ttf')}) format('truetype'); }}"
+            )
+        return "<style>\n" + "\n".join(faces) + "\n</style>"
+
+    # Fetch everything that is not on disk yet; True once all of it is there
+    def preload(self, logo_urls=()):
+        self._logo_urls.update(logo_urls)
+        results = [self.logo_png(url, download=True) for url in sorted(self._logo_urls)]
+        results += [self.font(False, download=True), self.font(True, download=True)]
+        return all(result is not None for result in results)
+
+    # Keep retrying preload() every `interval` seconds in the background until
+    # it succeeds (once per process; a no-op when everything is already there)
+    def start_retries(self, logo_urls=(), interval=RETRY_AFTER):
+        with self._lock:
+            if self._retry_pid == os.getpid():
+                return
+            self._retry_pid = os.getpid()
+            self._logo_urls.update(logo_urls)
+
+        def run():
+            while not self.preload():
+                time.sleep(interval)
+            log.info("assets_ready")
+
+        threading.Thread(target=run, name="asset-retry", daemon=True).start()
+
+# Shared instance used by the renderers
+assets = AssetManager()
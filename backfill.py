@@ -0,0 +1,295 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+from structured_log import get_logger
+
+# Regenerates historical receipts in bulk:
+#   python backfill.py --since 2025-02-01 --until 2025-02-28 --archive receipts/
+#   python backfill.py --since 2025-02-01 --until 2025-02-28 --telegram
+# Receipts are listed page by page from GET /receipts (cursor pagination, one
+# page fetched ahead), rendered and encoded on a process pool, and written to
+# an archive directory (<dir>/<YYYY-MM-DD>/<receipt_number>.<ext>) or sent to
+# TELEGRAM_CHAT_IDS. Every stage is bounded, so memory stays flat however long
+# the range is. Finished receipt numbers go to a checkpoint file, kept per
+# output (archive directory, or Telegram and the chat list); running the same
+# command again skips them, so an interrupted backfill resumes where it
+# stopped, while a different output starts from scratch. Renderer and image settings come from the same environment as the
+# service (RECEIPT_RENDERER, RECEIPT_FORMAT, ...).
+load_dotenv()
+log = get_logger("backfill")
+
+LOGO_URL = os.getenv(
+    "RECEIPT_LOGO",
+    "https://data-prod-eu-loyverse-com.s3.amazonaws.com/outlets/3279808/profile/emailLogo2024-07-23-09-19-35-035.png",
+)
+CHECKPOINT_EVERY = 50  # receipts between checkpoint writes
+
+# --- render workers (run in the process pool) ---
+
+_renderer = None
+_encoder = None
+
+def _init_worker(renderer_name):
+    global _renderer, _encoder
+    from assets import assets
+    from image_encoding import ImageEncoder
+    from receipt_template import ReceiptTemplate
+    from renderers import create_renderer
+    # Renders only read the asset cache, so fill it first
+    assets.preload([LOGO_URL])
+    template = ReceiptTemplate(constants=lambda: {
+        "logo_src": assets.logo_src(LOGO_URL),
+        "font_css": assets.font_css(),
+    })
+    _renderer = create_renderer(renderer_name, template)
+    _renderer.start()
+    _encoder = ImageEncoder(
+        os.getenv("RECEIPT_FORMAT", "png"),
+        colors=int(os.getenv("RECEIPT_COLORS", "0")) or None,
+        quality=int(os.getenv("RECEIPT_QUALITY", "85")),
+        max_bytes=int(os.getenv("RECEIPT_MAX_BYTES", "0")) or None,
+        crop=_renderer.crops,
+    )
+
+# Time printed on a historical receipt: when it was made, in local time
+def _receipt_time(receipt_data):
+    stamp = receipt_data.get("receipt_date") or receipt_data.get("created_at")
+    if not stamp:
+        return None
+    try:
+        moment = datetime.fromisoformat(stamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return moment.astimezone().strftime("%d/%m/%Y %H:%M")
+
+def _render(receipt_data):
+    image = _renderer.render(receipt_data, _receipt_time(receipt_data))
+    if image is None:
+        raise RuntimeError("renderer returned no image")
+    return _encoder.encode(image)
+
+# --- outputs ---
+
+class ArchiveOutput:
+    def __init__(self, directory, extension):
+        self.directory = directory
+        self.target = f"archive:{os.path.abspath(directory)}"
+        self.extension = extension
+
+    def write(self, receipt_data, image):
+        day = (receipt_data.get("receipt_date") or receipt_data.get("created_at") or "undated")[:10]
+        directory = os.path.join(self.directory, day)
+        os.makedirs(directory, exist_ok=True)
+        name = str(receipt_data.get("receipt_number", "N/A")).replace(os.sep, "_")
+        path = os.path.join(directory, f"{name}.{self.extension}")
+        with open(path + ".tmp", "wb") as file:
+            file.write(image)
+        os.replace(path + ".tmp", path)
+        return True
+
+class TelegramOutput:
+    def __init__(self, chats, mime):
+        from fanout import fan_out
+        from send_scheduler import SendScheduler
+        from telegram_client import TelegramClient
+        self.chats = chats
+        self.mime = mime
+        self.target = "telegram:" + ",".join(sorted(chats))
+        self._fan_out = fan_out
+        self.telegram = TelegramClient(os.getenv("TELEGRAM_BOT_TOKEN"))
+        self.sender = SendScheduler(
+            self.telegram,
+            chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "20")) / 60,
+            global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+            album_window=float(os.getenv("TELEGRAM_ALBUM_WINDOW", "2")),
+        )
+
+    def write(self, receipt_data, image):
+        outcome = self._fan_out(self.sender, [image], [self.chats],
+                                captions=[f"Receipt № {receipt_data.get('receipt_number', 'N/A')}"],
+                                mime=self.mime)[0]
+        return all(outcome.values())
+
+# --- checkpoint ---
+
+# Receipt numbers already written to `target`, saved atomically every
+# CHECKPOINT_EVERY receipts and on exit. One file holds every target's list,
+# so archiving a range and then sending it to Telegram skips nothing.
+class Checkpoint:
+    def __init__(self, path, target):
+        self.path = path
+        self.target = target
+        self.done = set()
+        self._targets = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as file:
+                self._targets = json.load(file).get("targets", {})
+            self.done = set(self._targets.get(target, []))
+
+    def __contains__(self, receipt_number):
+        return receipt_number in self.done
+
+    def mark(self, receipt_number):
+        with self._lock:
+            self.done.add(receipt_number)
+            self._unsaved += 1
+            if self._unsaved >= CHECKPOINT_EVERY:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        self._targets[self.target] = sorted(self.done)
+        with open(self.path + ".tmp", "w") as file:
+            json.dump({"targets": self._targets, "saved_at": datetime.now().isoformat()}, file)
+        os.replace(self.path + ".tmp", self.path)
+        self._unsaved = 0
+
+# --- pipeline ---
+
+# Iterate `items` on a background thread, at most `size` ahead of the consumer
+def _prefetch(items, size):
+    buffer = queue.Queue(size)
+    done = object()
+
+    def fill():
+        try:
+            for item in items:
+                buffer.put(item)
+        except Exception as e:
+            buffer.put(e)
+        buffer.put(done)
+
+    threading.Thread(target=fill, name="backfill-pages", daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def _day(text, end=False):
+    day = date.fromisoformat(text) + timedelta(days=1 if end else 0)
+    return f"{day.isoformat()}T00:00:00.000Z"
+
+def run(args):
+    from loyverse_client import PAGE_LIMIT, LoyverseClient
+    from image_encoding import MIME_TYPES
+    from reference_data import ReferenceData
+
+    renderer_name = args.renderer or os.getenv("RECEIPT_RENDERER", "wkhtmltoimage")
+    receipt_format = os.getenv("RECEIPT_FORMAT", "png")
+    if args.archive:
+        output = ArchiveOutput(args.archive, {"jpeg": "jpg"}.get(receipt_format, receipt_format))
+    else:
+        chats = [chat.strip() for chat in os.getenv("TELEGRAM_CHAT_IDS", os.getenv("TELEGRAM_CHAT_ID", "")).split(",")
+                 if chat.strip()]
+        if not chats or not os.getenv("TELEGRAM_BOT_TOKEN"):
+            raise SystemExit("Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_IDS to backfill to Telegram")
+        output = TelegramOutput(chats, MIME_TYPES[receipt_format])
+    checkpoint = Checkpoint(args.checkpoint, output.target)
+    loyverse = LoyverseClient(os.getenv("LOYVERSE_ACCESS_TOKEN"))
+    # Employee/store/payment-type names, fetched once for the whole run
+    reference = ReferenceData(loyverse)
+    reference.refresh()
+
+    # Spawned, not forked: the parent already runs threads (page prefetch, logging)
+    pool = ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(renderer_name,))
+    writers = ThreadPoolExecutor(args.writers, thread_name_prefix="backfill-write")
+    writing = threading.BoundedSemaphore(args.writers * 2)
+    counts = {"listed": 0, "skipped": 0, "written": 0, "render_failed": 0, "write_failed": 0}
+    count_lock = threading.Lock()
+
+    def count(key):
+        with count_lock:
+            counts[key] += 1
+
+    def write(receipt_data, image):
+        try:
+            if output.write(receipt_data, image):
+                checkpoint.mark(receipt_data.get("receipt_number"))
+                count("written")
+            else:
+                count("write_failed")
+        except Exception:
+            count("write_failed")
+            log.exception("backfill_write_failed", receipt_number=receipt_data.get("receipt_number"))
+        finally:
+            writing.release()
+
+    # Renders finish in listing order; each is handed to a writer as it completes
+    def finish(receipt_data, future):
+        try:
+            image = future.result()
+        except Exception as e:
+            count("render_failed")
+            log.error("backfill_render_failed", receipt_number=receipt_data.get("receipt_number"), error=str(e))
+            return
+        writing.acquire()
+        writers.submit(write, receipt_data, image)
+
+    started = time.monotonic()
+    in_flight = deque()
+    try:
+        receipts = loyverse.receipts(_day(args.since), _day(args.until, end=True))
+        for receipt_data in _prefetch(receipts, PAGE_LIMIT):
+            count("listed")
+            if receipt_data.get("receipt_number") in checkpoint or receipt_data.get("cancelled_at"):
+                count("skipped")
+                continue
+            in_flight.append((receipt_data, pool.submit(_render, reference.annotate(receipt_data))))
+            if len(in_flight) >= args.processes * 2:
+                finish(*in_flight.popleft())
+            if counts["listed"] % 100 == 0:
+                log.info("backfill_progress", **counts, seconds=round(time.monotonic() - started, 1))
+        while in_flight:
+            finish(*in_flight.popleft())
+        writers.shutdown(wait=True)
+    finally:
+        # On Ctrl-C, everything written so far is kept for the next run
+        for _, future in in_flight:
+            future.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
+        writers.shutdown(wait=True)
+        checkpoint.save()
+    counts["seconds"] = round(time.monotonic() - started, 1)
+    log.info("backfill_finished", **counts)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Render historical Loyverse receipts in bulk")
+    parser.add_argument("--since", required=True, help="first day, YYYY-MM-DD (UTC)")
+    parser.add_argument("--until", required=True, help="last day, YYYY-MM-DD (UTC, inclusive)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--archive", metavar="DIR", help="write images under DIR/<day>/")
+    target.add_argument("--telegram", action="store_true", help="send images to TELEGRAM_CHAT_IDS")
+    parser.add_argument("--renderer", help="backend (default RECEIPT_RENDERER)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2, help="render processes")
+    parser.add_argument("--writers", type=int, default=4, help="concurrent archive writes / Telegram sends")
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json",
+                        help="file of finished receipts; rerun to resume ('' to disable)")
+    args = parser.parse_args()
+    counts = run(args)
+    print(json.dumps(counts))
+    return 1 if counts["render_failed"] or counts["write_failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Renderer benchmark: synthetic Loyverse receipts with 1, 10, 100 and 1000
+# line items through every backend, timing each stage separately
+#   build      receipt data -> HTML (compiled template) or layout (native)
+#   rasterize  HTML/layout -> PNG (wkhtmltoimage, Chromium, node, Pillow)
+#   encode     PNG -> uploaded bytes (ImageEncoder, as configured by RECEIPT_*)
+# and reporting p50/p95/p99 per stage, peak RSS (the benchmark process plus
+# any renderer subprocesses, summed over the live process tree) and output size. Every backend/size pair runs in
+# its own process so RSS figures do not leak between them. Backends that are
+# not installed are skipped.
+#   python bench_renderers.py                      run and compare with the baseline
+#   python bench_renderers.py --save-baseline      run and store the results as the new baseline
+#   python bench_renderers.py --backends native --sizes 1 10
+BACKENDS = ["wkhtmltoimage", "pyppeteer", "node", "native"]  # names registered in renderers.py
+SIZES = [1, 10, 100, 1000]
+RUNS = {1: 30, 10: 30, 100: 10, 1000: 3}
+STAGES = ["build", "rasterize", "encode"]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+THRESHOLD = 0.20  # slowdown / growth over the baseline that counts as a regression
+
+def make_receipt(num_items):
+    return {
+        "receipt_number": f"1-{num_items:04d}",
+        "employee_id": "Owner",
+        "store_id": "ahmedshahyyd",
+        "total_money": 315.0 * num_items,
+        "line_items": [
+            {"item_name": f"Laneige Lip Glowy Balm Berry #{i}", "quantity": 1 + i % 3, "price": 315.0}
+            for i in range(num_items)
+        ],
+        "payments": [{"name": "Transfer", "money_amount": 315.0 * num_items}],
+    }
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def _summary(seconds):
+    return {f"p{pct}": round(_percentile(seconds, pct) * 1000, 2) for pct in (50, 95, 99)}
+
+# Largest single process seen: this one, or a renderer subprocess that has
+# exited and been waited for (RUSAGE_CHILDREN only counts reaped children)
+def _peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)  # ru_maxrss is in KiB on Linux
+
+# Resident bytes of this process and every descendant (browser, node daemon,
+# their helpers), read from /proc; 0 where there is no /proc
+def _tree_rss():
+    if not os.path.isdir("/proc"):
+        return 0
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as file:
+                parent = int(file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(name))
+    total, pending = 0, [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/statm") as file:
+                total += int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+# Samples _tree_rss() on a background thread and keeps the peak, so renderer
+# processes that are still running when the case ends are counted too
+class _TreeRssSampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while True:
+            self.peak = max(self.peak, _tree_rss())
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return round(self.peak / 1024 / 1024, 1)
+
+# Runs in a child process: one backend, one size
+def run_case(backend, size, runs):
+    from image_encoding import ImageEncoder
+    from receipt_template import ReceiptTemplate
+    from renderers import create_renderer
+    sampler = _TreeRssSampler()
+    sampler.start()
+    renderer = create_renderer(backend, ReceiptTemplate())
+    build, rasterize = renderer.build, renderer.rasterize
+    encoder = ImageEncoder(
+        os.getenv("RECEIPT_FORMAT", "png"),
+        colors=int(os.getenv("RECEIPT_COLORS", "0")) or None,
+        quality=int(os.getenv("RECEIPT_QUALITY", "85")),
+        max_bytes=int(os.getenv("RECEIPT_MAX_BYTES", "0")) or None,
+        crop=renderer.crops,
+    )
+    receipt_data = make_receipt(size)
+    encode = encoder.encode
+
+    # One untimed render warms caches, fonts and browser pages
+    encode(rasterize(build(receipt_data)))
+    times = {stage: [] for stage in STAGES + ["total"]}
+    output = b""
+    for _ in range(runs):
+        started = time.perf_counter()
+        built = build(receipt_data)
+        built_at = time.perf_counter()
+        image = rasterize(built)
+        rasterized_at = time.perf_counter()
+        output = encode(image)
+        finished = time.perf_counter()
+        times["build"].append(built_at - started)
+        times["rasterize"].append(rasterized_at - built_at)
+        times["encode"].append(finished - rasterized_at)
+        times["total"].append(finished - started)
+    tree_peak = sampler.stop()
+    # Shut the browser / daemon down and wait for it, so its own peak shows in
+    # RUSAGE_CHILDREN as well
+    renderer.close()
+    return {
+        "backend": backend,
+        "items": size,
+        "runs": runs,
+        "ms": {stage: _summary(values) for stage, values in times.items()},
+        "peak_rss_mb": max(tree_peak, _peak_rss_mb()),
+        "output_bytes": len(output),
+    }
+
+# The case writes its result to a file of its own; stdout carries the JSON
+# logs of the renderers, written from a background thread
+def run_isolated(backend, size, runs):
+    with tempfile.TemporaryDirectory() as directory:
+        result_path = os.path.join(directory, "result.json")
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--case", backend, str(size), str(runs), result_path],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if process.returncode != 0 or not os.path.exists(result_path):
+            reason = (process.stderr.strip().splitlines() or ["failed"])[-1]
+            return {"backend": backend, "items": size, "skipped": reason}
+        with open(result_path) as file:
+            return json.load(file)
+
+def _key(result):
+    return f"{result['backend']}/{result['items']}"
+
+# Regressions against the baseline: slower p50/p95, more memory, bigger output
+def compare(results, baseline, threshold=THRESHOLD):
+    flags = []
+    for result in results:
+        old = baseline.get(_key(result))
+        if "skipped" in result or not old or "skipped" in old:
+            continue
+        checks = [("total p50 ms", result["ms"]["total"]["p50"], old["ms"]["total"]["p50"]),
+                  ("total p95 ms", result["ms"]["total"]["p95"], old["ms"]["total"]["p95"]),
+                  ("peak RSS MB", result["peak_rss_mb"], old["peak_rss_mb"]),
+                  ("output bytes", result["output_bytes"], old["output_bytes"])]
+        for stage in STAGES:
+            checks.append((f"{stage} p50 ms", result["ms"][stage]["p50"], old["ms"][stage]["p50"]))
+        for label, new, previous in checks:
+            # Sub-millisecond stages jitter too much to judge on ratio alone
+            if previous and new > previous * (1 + threshold) and not (label.endswith("ms") and new - previous < 1):
+                flags.append(f"{_key(result)}: {label} {previous} -> {new} (+{100 * (new / previous - 1):.0f}%)")
+    return flags
+
+def print_table(results):
+    print(f"{'backend':<14}{'items':>6}  {'build p50/p95/p99':>22}  {'rasterize p50/p95/p99':>24}  "
+          f"{'encode p50/p95/p99':>22}  {'total p50':>9}  {'RSS MB':>7}  {'bytes':>9}")
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['backend']:<14}{result['items']:>6}  skipped: {result['skipped']}")
+            continue
+        stages = ["/".join(f"{result['ms'][stage][p]:.1f}" for p in ("p50", "p95", "p99")) for stage in STAGES]
+        print(f"{result['backend']:<14}{result['items']:>6}  {stages[0]:>22}  {stages[1]:>24}  {stages[2]:>22}  "
+              f"{result['ms']['total']['p50']:>9.1f}  {result['peak_rss_mb']:>7.1f}  {result['output_bytes']:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark receipt renderers")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--runs", type=int, help="renders per case (default depends on size)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--case", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        backend, size, runs, result_path = args.case
+        result = run_case(backend, int(size), int(runs))
+        with open(result_path, "w") as file:
+            json.dump(result, file)
+        return 0
+
+    results = []
+    for backend in args.backends:
+        for size in args.sizes:
+            results.append(run_isolated(backend, size, args.runs or RUNS.get(size, 10)))
+    print_table(results)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update({_key(result): result for result in results if "skipped" not in result})
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as file:
+        flags = compare(results, json.load(file), args.threshold)
+    if flags:
+        print(f"Regressions over {100 * args.threshold:.0f}% against {args.baseline}:")
+        for flag in flags:
+            print(f"  {flag}")
+        return 1
+    print(f"No regressions against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import timeit
+from receipt_template import ReceiptTemplate, TEMPLATE_PATH
+
+# Per-render cost of the compiled receipt template against the old way of
+# building the HTML on every call (string += per line item, then filling
+# the whole document), for receipts with 1 to 500 line items.
+#   python bench_template.py
+SIZES = [1, 10, 50, 100, 250, 500]
+
+def make_receipt(num_items):
+    return {
+        "receipt_number": "1-1003",
+        "employee_id": "Owner",
+        "store_id": "ahmedshahyyd",
+        "total_money": 315.0 * num_items,
+        "line_items": [
+            {"item_name": f"Laneige Lip Glowy Balm #{i}", "quantity": 1, "price": 315.0}
+            for i in range(num_items)
+        ],
+        "payments": [{"name": "Transfer", "money_amount": 315.0 * num_items}],
+    }
+
+# Static parts of the document, standing in for the literal the handlers embedded
+with open(TEMPLATE_PATH, encoding="utf-8") as file:
+    head, rest = file.read().split("<!-- line_item -->", 1)
+_, rest = rest.split("<!-- /line_item -->", 1)
+middle, rest = rest.split("<!-- payment -->", 1)
+_, tail = rest.split("<!-- /payment -->", 1)
+
+# Same work the handlers used to do on every call
+def per_call_render(receipt_data):
+    line_items_html = ""
+    for item in receipt_data.get("line_items", []):
+        item_name = item.get("item_name", "Item")
+        quantity = item.get("quantity", 0)
+        unit_price = item.get("price", 0)
+        line_total = quantity * unit_price
+        line_items_html += f"""
+        <div class="item">
+            <span>{item_name}</span>
+            <span>MVR {line_total:.2f}</span>
+        </div>
+        <span class="footer-inline">{quantity} × MVR {unit_price:.2f}</span>
+        """
+    payment_html = ""
+    for payment in receipt_data.get("payments", []):
+        payment_html += f"""
+        <div class="item">
+            <span>{payment.get("name", "Payment")}</span>
+            <span>MVR {payment.get("money_amount", 0):.2f}</span>
+        </div>
+        """
+    receipt_html = head + line_items_html + middle + payment_html + tail
+    for key, value in (
+        ("total_amount", f"{receipt_data.get('total_money', 0):.2f}"),
+        ("employee_name", receipt_data.get("employee_id", "N/A")),
+        ("store_name", receipt_data.get("store_id", "N/A")),
+        ("receipt_number", receipt_data.get("receipt_number", "N/A")),
+        ("server_time", "05/02/2025 12:44"),
+    ):
+        receipt_html = receipt_html.replace("{{ " + key + " }}", value)
+    return receipt_html
+
+def per_render_us(func, receipt_data):
+    number = max(5, 2000 // len(receipt_data["line_items"]))
+    best = min(timeit.repeat(lambda: func(receipt_data), number=number, repeat=5))
+    return best / number * 1e6
+
+if __name__ == "__main__":
+    template = ReceiptTemplate()
+    compiled = lambda receipt_data: template.render(receipt_data, server_time="05/02/2025 12:44")
+    print(f"{'items':>6} {'per-call (us)':>14} {'compiled (us)':>14} {'speedup':>8}")
+    for size in SIZES:
+        receipt_data = make_receipt(size)
+        old = per_render_us(per_call_render, receipt_data)
+        new = per_render_us(compiled, receipt_data)
+        print(f"{size:>6} {old:>14.1f} {new:>14.1f} {old / new:>7.1f}x")
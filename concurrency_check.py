@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import Pool
+
+# Exercises the service the way `gunicorn -w N --threads M` does: several
+# processes each posting overlapping webhook payloads from several threads,
+# with Loyverse-style retries of the same receipts. Telegram is replaced by a
+# recorder and the native renderer is used, so nothing leaves the machine.
+# Checks that every receipt is uploaded exactly once, with its own image,
+# and reaches the other two configured chats by file_id.
+#   python concurrency_check.py [processes] [threads] [receipts]
+PROCESSES = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+RECEIPTS = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+
+def make_receipt(number):
+    return {
+        "receipt_number": f"9-{number:04d}",
+        "employee_id": "Owner",
+        "store_id": "check",
+        "total_money": float(number),
+        "line_items": [{"item_name": f"Item {number}", "quantity": 1, "price": float(number)}],
+        "payments": [{"name": "Transfer", "money_amount": float(number)}],
+    }
+
+# One "gunicorn worker": post every receipt from THREADS threads, twice over
+def run_worker(_):
+    import app
+
+    sent = []
+    sent_lock = threading.Lock()
+
+    # Stands in for the send scheduler; uploads are recorded, file_id re-sends counted
+    class Recorder:
+        resends = 0
+
+        def submit(self, method, chat_id, image, **kwargs):
+            future = Future()
+            with sent_lock:
+                if isinstance(image, bytes):
+                    sent.append(image)
+                    file_id = f"file-{len(sent)}"
+                else:
+                    Recorder.resends += 1
+                    file_id = image
+            future.set_result({"message_id": 1, "photo": [{"file_id": file_id}]})
+            return future
+
+    app.sender = Recorder()
+    client = app.app.test_client()
+    payloads = [{"receipts": [make_receipt(n), make_receipt((n + 1) % RECEIPTS)]} for n in range(RECEIPTS)]
+    with ThreadPoolExecutor(THREADS) as pool:
+        statuses = list(pool.map(lambda payload: client.post("/webhook", json=payload).status_code, payloads * 2))
+    app.render_queue.join()
+    return statuses, sent, Recorder.resends
+
+def main():
+    directory = tempfile.mkdtemp(prefix="receipt-check-")
+    os.environ["LEDGER_PATH"] = os.path.join(directory, "deliveries.db")
+    os.environ["RECEIPT_RENDERER"] = "native"
+    os.environ["RECONCILE"] = "0"
+    os.environ["REFERENCE_DATA"] = "0"
+    os.environ["TELEGRAM_CHAT_IDS"] = "owner,group,accounts"
+    os.environ.setdefault("RENDER_WORKERS", "2")
+
+    with Pool(PROCESSES) as pool:
+        results = pool.map(run_worker, range(PROCESSES))
+
+    images = [image for _, sent, _ in results for image in sent]
+    statuses = [status for result, _, _ in results for status in result]
+    resends = sum(count for _, _, count in results)
+    print(f"{PROCESSES} processes x {THREADS} threads: {len(statuses)} webhooks, "
+          f"{statuses.count(200)} accepted, {len(images)} images uploaded, {resends} re-sent by file_id")
+
+    ok = True
+    if len(images) != RECEIPTS:
+        print(f"FAIL: expected {RECEIPTS} uploads, got {len(images)}")
+        ok = False
+    if resends != RECEIPTS * 2:
+        print(f"FAIL: expected {RECEIPTS * 2} re-sends to the other two chats, got {resends}")
+        ok = False
+    # Receipts differ in number and total, so identical bytes mean a mixed-up image
+    if len(set(images)) != len(images):
+        print("FAIL: the same image was sent for more than one receipt")
+        ok = False
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from structured_log import get_logger
+
+log = get_logger("delivery_ledger")
+
+# Persistent record of receipts already handled, keyed on receipt_number.
+# Loyverse retries webhooks, so every receipt is claimed here before any
+# rendering work; a claim only succeeds once, until it is released after a
+# failure. SQLite runs in WAL mode so several gunicorn workers can share the
+# file, and delivered receipts are also kept in a small in-memory cache so
+# repeated retries never touch the disk. When a receipt goes to several
+# chats, each chat that got it is recorded as well, so a retry after a
+# partial failure only sends to the chats that are still missing it.
+# Each claim records its owner (host:pid), so an unfinished claim can be
+# retaken as soon as the process that held it is gone, not only once it
+# has outlived claim_timeout.
+PENDING = "pending"
+RENDERED = "rendered"
+DELIVERED = "delivered"
+
+class DeliveryLedger:
+    def __init__(self, path="deliveries.db", retention_days=30, cache_size=2000,
+                 claim_timeout=600, compact_interval=3600):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.cache_size = cache_size
+        self.claim_timeout = claim_timeout        # seconds before an undelivered claim can be retaken
+        self.compact_interval = compact_interval  # seconds between compactions
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._last_compact = time.time()
+
+    # One connection per process; reopened after a gunicorn fork
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " receipt_number TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " claimed_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " owner TEXT)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(deliveries)")]
+            if "owner" not in columns:
+                # Ledger from before owners were recorded; its rows fall back to claim_timeout
+                try:
+                    conn.execute("ALTER TABLE deliveries ADD COLUMN owner TEXT")
+                except sqlite3.OperationalError:
+                    pass  # another worker added it first
+            conn.execute("CREATE INDEX IF NOT EXISTS deliveries_updated_at ON deliveries (updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_deliveries ("
+                " receipt_number TEXT NOT NULL,"
+                " chat_id TEXT NOT NULL,"
+                " delivered_at REAL NOT NULL,"
+                " PRIMARY KEY (receipt_number, chat_id))"
+            )
+            # Small named values shared by all workers (e.g. the reconciler's
+            # high-water mark) and leases that let one worker own a job
+            conn.execute("CREATE TABLE IF NOT EXISTS marks (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " name TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+            self._cache.clear()
+        return self._conn
+
+    def _remember(self, receipt_number):
+        self._cache[receipt_number] = True
+        self._cache.move_to_end(receipt_number)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # host:pid of the calling process, recorded on its claims
+    @staticmethod
+    def owner():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    # True if owner is a process on this host that no longer exists. Owners on
+    # other hosts can't be checked and count as alive until claim_timeout.
+    @staticmethod
+    def _gone(owner):
+        host, _, pid = (owner or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass  # exists but belongs to someone else
+        return False
+
+    # True if this caller now owns the receipt and should render/deliver it.
+    # An unfinished claim is retaken when its owner has died or it is older
+    # than claim_timeout.
+    def claim(self, receipt_number):
+        if not receipt_number or receipt_number == "N/A":
+            return True
+        now = time.time()
+        owner = self.owner()
+        with self._lock:
+            if receipt_number in self._cache:
+                return False
+            conn = self._connection()
+            claimed = conn.execute(
+                "INSERT OR IGNORE INTO deliveries (receipt_number, status, claimed_at, updated_at, owner)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (receipt_number, PENDING, now, now, owner)
+            ).rowcount == 1
+            if not claimed:
+                row = conn.execute(
+                    "SELECT status, claimed_at, owner FROM deliveries WHERE receipt_number = ?", (receipt_number,)
+                ).fetchone()
+                if row and row[0] == DELIVERED:
+                    self._remember(receipt_number)
+                elif row and (row[1] < now - self.claim_timeout or self._gone(row[2])):
+                    # Take over a claim left behind by a worker that died before
+                    # delivering; the WHERE makes sure only one worker does
+                    claimed = conn.execute(
+                        "UPDATE deliveries SET status = ?, claimed_at = ?, updated_at = ?, owner = ?"
+                        " WHERE receipt_number = ? AND status != ? AND claimed_at = ? AND owner IS ?",
+                        (PENDING, now, now, owner, receipt_number, DELIVERED, row[1], row[2])
+                    ).rowcount == 1
+        self._maybe_compact()
+        return claimed
+
+    # Keep only the receipts in the payload that nobody has handled yet
+    def claim_new(self, receipts):
+        fresh = []
+        for receipt_data in receipts:
+            receipt_number = receipt_data.get("receipt_number", "N/A")
+            if self.claim(receipt_number):
+                fresh.append(receipt_data)
+            else:
+                log.info("duplicate_receipt_skipped", receipt_number=receipt_number)
+        return fresh
+
+    # claim_new without the log line per skipped receipt; used by the
+    # reconciler, which re-reads an hour of receipts on every poll
+    def claim_unhandled(self, receipts):
+        return [
+            receipt_data for receipt_data in receipts
+            if self.claim(receipt_data.get("receipt_number", "N/A"))
+        ]
+
+    def _set_status(self, receipt_number, status):
+        if not receipt_number or receipt_number == "N/A":
+            return
+        with self._lock:
+            self._connection().execute(
+                "UPDATE deliveries SET status = ?, updated_at = ? WHERE receipt_number = ?",
+                (status, time.time(), receipt_number)
+            )
+            if status == DELIVERED:
+                self._remember(receipt_number)
+
+    def mark_rendered(self, receipt_number):
+        self._set_status(receipt_number, RENDERED)
+
+    def mark_delivered(self, receipt_number):
+        self._set_status(receipt_number, DELIVERED)
+
+    # Drop an unfinished claim so the next webhook retry can try again
+    def release(self, receipt_number):
+        if not receipt_number or receipt_number == "N/A":
+            return
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM deliveries WHERE receipt_number = ? AND status != ?",
+                (receipt_number, DELIVERED)
+            )
+
+    def mark_chat_delivered(self, receipt_number, chat_id):
+        if not receipt_number or receipt_number == "N/A":
+            return
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO chat_deliveries VALUES (?, ?, ?)",
+                (receipt_number, str(chat_id), time.time())
+            )
+
+    # Chats that already have this receipt
+    def delivered_chats(self, receipt_number):
+        if not receipt_number or receipt_number == "N/A":
+            return set()
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT chat_id FROM chat_deliveries WHERE receipt_number = ?", (receipt_number,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def release_all(self, receipts):
+        for receipt_data in receipts:
+            self.release(receipt_data.get("receipt_number", "N/A"))
+
+    def status(self, receipt_number):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT status FROM deliveries WHERE receipt_number = ?", (receipt_number,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_mark(self, name, default=None):
+        with self._lock:
+            row = self._connection().execute("SELECT value FROM marks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_mark(self, name, value):
+        with self._lock:
+            self._connection().execute("INSERT OR REPLACE INTO marks VALUES (?, ?)", (name, value))
+
+    # True if owner holds the named lease for the next ttl seconds: it was free,
+    # had expired, or owner already held it (which renews it)
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR IGNORE INTO leases VALUES (?, ?, ?)", (name, owner, now + ttl))
+            return conn.execute(
+                "UPDATE leases SET owner = ?, expires_at = ? WHERE name = ? AND (owner = ? OR expires_at < ?)",
+                (owner, now + ttl, name, owner, now)
+            ).rowcount == 1
+
+    def _maybe_compact(self):
+        if time.time() - self._last_compact >= self.compact_interval:
+            self.compact()
+
+    # Forget receipts older than the retention window and shrink the WAL
+    def compact(self):
+        with self._lock:
+            self._last_compact = time.time()
+            conn = self._connection()
+            cutoff = self._last_compact - self.retention
+            removed = conn.execute("DELETE FROM deliveries WHERE updated_at < ?", (cutoff,)).rowcount
+            conn.execute("DELETE FROM chat_deliveries WHERE delivered_at < ?", (cutoff,))
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if removed:
+                self._cache.clear()
+        if removed:
+            log.info("ledger_compacted", removed=removed)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM deliveries GROUP BY status"
+            ).fetchall()
+        stats = {PENDING: 0, RENDERED: 0, DELIVERED: 0}
+        stats.update(dict(rows))
+        stats["cached"] = len(self._cache)
+        return stats
@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import Future
+from telegram_client import photo_file_id
+
+# Deliver each image to several chats while uploading its bytes only once:
+# the image goes to its first chat as an upload, and the file_id Telegram
+# returns is what the remaining chats are sent, all of them at once through
+# the send scheduler (each chat is paced by its own bucket). If the upload
+# fails the other chats get the bytes instead, so one bad chat does not hold
+# back the rest.
+#   chats[i] lists the chat ids image i still has to reach
+# Other keyword arguments (e.g. mime) go to every send_photo call.
+# Returns, per image, a Future of {chat_id: True/False} for every chat
+# attempted. Nothing here blocks: the re-sends are queued from the upload's
+# done-callback, so the caller can move on while the scheduler paces sends.
+def fan_out_futures(sender, images, chats, captions=None, **kwargs):
+    captions = captions or [None] * len(images)
+    results = []
+    # Upload every image to its first chat (same-chat uploads may form an album)
+    for image, targets, caption in zip(images, chats, captions):
+        result = Future()
+        results.append(result)
+        if not targets:
+            result.set_result({})
+            continue
+        upload = sender.submit("send_photo", targets[0], image, caption=caption, **kwargs)
+        upload.add_done_callback(
+            lambda upload, image=image, targets=targets, caption=caption, result=result:
+                _resend(sender, upload, image, targets, caption, result, kwargs)
+        )
+    return results
+
+# Everyone else gets the uploaded file, every chat at once
+def _resend(sender, upload, image, targets, caption, result, kwargs):
+    message = _message(upload)
+    outcome = {targets[0]: message is not None}
+    rest = targets[1:]
+    if not rest:
+        result.set_result(outcome)
+        return
+    source = photo_file_id(message) or image
+    lock = threading.Lock()
+    remaining = [len(rest)]
+
+    def done(future, chat_id):
+        with lock:
+            outcome[chat_id] = _message(future) is not None
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            result.set_result(outcome)
+
+    for chat_id in rest:
+        future = sender.submit("send_photo", chat_id, source, caption=caption, **kwargs)
+        future.add_done_callback(lambda future, chat_id=chat_id: done(future, chat_id))
+
+# A send that raised counts as not delivered
+def _message(future):
+    try:
+        return future.result()
+    except Exception:
+        return None
+
+# Blocking form of fan_out_futures: returns, per image, {chat_id: True/False}
+def fan_out(sender, images, chats, captions=None, **kwargs):
+    return [future.result() for future in fan_out_futures(sender, images, chats, captions, **kwargs)]
@@ -0,0 +1,18 @@
+import os
+
+# gunicorn settings for the webhook service:
+#   sudo gunicorn -c gunicorn.conf.py -D app:app
+# Every worker process has its own render queue, page pool and ledger
+# connection; receipts are deduplicated across workers by the shared SQLite
+# ledger, and renders keep everything in memory, so workers and threads can be
+# raised freely.
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# The app splits the Telegram rate limits between workers using this
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# Load the app in each worker after the fork, so no thread, browser or
+# database connection is ever shared between processes
+preload_app = False
@@ -0,0 +1,150 @@
+import io
+import sys
+import threading
+from PIL import Image, ImageChops
+
+# Output encoding for receipt images. Renderers hand over PNG bytes (or a
+# Pillow image from the native renderer); the encoder turns them into what
+# is actually uploaded:
+#   png   - as rendered, or quantised to a small palette (receipts are a few
+#           greys on white, so 64 colours look identical and are far smaller)
+#   webp  - lossy WebP at the given quality
+#   jpeg  - baseline JPEG at the given quality
+# With crop set, the margin of page background around the receipt is cut
+# off first, so wkhtmltoimage output (which is as tall as the page, not the
+# card) is trimmed to the receipt's real bounding box. With max_bytes set,
+# the quality (or palette size for PNG) is searched for the best image that
+# fits the budget. Sizes before and after are counted so the bytes saved can
+# be reported; a Pillow image has no size before encoding, so those images
+# only count towards bytes_out.
+MIME_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+PALETTE_STEPS = (256, 128, 64, 32, 16)
+
+class ImageEncoder:
+    def __init__(self, format="png", colors=None, quality=85, max_bytes=None, min_quality=30, crop=False):
+        if format not in MIME_TYPES:
+            raise ValueError(f"Unknown receipt image format {format!r}, expected one of {', '.join(MIME_TYPES)}")
+        self.format = format
+        self.colors = colors            # PNG palette size; None keeps full colour
+        self.quality = quality          # WebP/JPEG quality, the starting point for the search
+        self.max_bytes = max_bytes      # byte budget per image; None for no limit
+        self.min_quality = min_quality  # lowest quality the budget search may pick
+        self.crop = crop                # trim the page background around the receipt
+        self.mime = MIME_TYPES[format]
+        self._lock = threading.Lock()
+        self._counts = {"images": 0, "bytes_in": 0, "bytes_out": 0, "over_budget": 0, "unmeasured": 0}
+        self._measured_out = 0  # bytes_out of the images that have a bytes_in
+
+    # Full-colour PNG bytes need no work at all
+    @property
+    def passthrough(self):
+        return self.format == "png" and not self.colors and not self.max_bytes and not self.crop
+
+    def _save(self, image, **params):
+        buffer = io.BytesIO()
+        if self.format == "png":
+            colors = params.get("colors")
+            if colors:
+                image = image.convert("RGB").quantize(colors, method=Image.Quantize.FASTOCTREE,
+                                                      dither=Image.Dither.NONE)
+            image.save(buffer, format="PNG", compress_level=6 if colors else 1)
+        elif self.format == "webp":
+            image.save(buffer, format="WEBP", quality=params["quality"], method=4)
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=params["quality"], optimize=True)
+        return buffer.getvalue()
+
+    # Best encoding that fits max_bytes, or the smallest one tried if none does
+    def _fit(self, image):
+        if self.format == "png":
+            steps = [self.colors] if self.colors else [None]
+            steps += [colors for colors in PALETTE_STEPS if colors < (self.colors or 512)]
+            smallest = None
+            for colors in steps:
+                data = self._save(image, colors=colors)
+                if self.max_bytes is None or len(data) <= self.max_bytes:
+                    return data
+                if smallest is None or len(data) < len(smallest):
+                    smallest = data
+            return smallest
+
+        data = self._save(image, quality=self.quality)
+        if self.max_bytes is None or len(data) <= self.max_bytes:
+            return data
+        # Binary search for the highest quality that fits
+        low, high, best = self.min_quality, self.quality - 1, None
+        while low <= high:
+            quality = (low + high) // 2
+            candidate = self._save(image, quality=quality)
+            if len(candidate) <= self.max_bytes:
+                best, low = candidate, quality + 1
+            else:
+                high = quality - 1
+        return best or self._save(image, quality=self.min_quality)
+
+    # PNG bytes or a Pillow image in, encoded bytes out
+    def encode(self, image):
+        original_size = len(image) if isinstance(image, bytes) else None
+        if isinstance(image, bytes):
+            if self.passthrough:
+                self._record(original_size, original_size)
+                return image
+            image = Image.open(io.BytesIO(image))
+        if self.crop:
+            image = crop_to_content(image)
+        data = self._fit(image)
+        self._record(original_size, len(data))
+        return data
+
+    def _record(self, size_in, size_out):
+        with self._lock:
+            self._counts["images"] += 1
+            self._counts["bytes_out"] += size_out
+            if size_in is None:
+                self._counts["unmeasured"] += 1
+            else:
+                self._counts["bytes_in"] += size_in
+                self._measured_out += size_out
+            if self.max_bytes and size_out > self.max_bytes:
+                self._counts["over_budget"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            measured_out = self._measured_out
+        stats["format"] = self.format
+        stats["bytes_saved"] = stats["bytes_in"] - measured_out
+        stats["saved_pct"] = round(100 * stats["bytes_saved"] / stats["bytes_in"], 1) if stats["bytes_in"] else 0.0
+        return stats
+
+
+# Cut away the uniform background (the colour of the top-left pixel) around
+# the content; the card's soft shadow counts as content and is kept
+def crop_to_content(image):
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    box = ImageChops.difference(image, background).getbbox()
+    return image.crop(box) if box else image
+
+
+# Size of every output option for the given PNG receipts
+#   python image_encoding.py receipt.png [more.png ...]
+def report(paths):
+    options = [("png", {}), ("png", {"colors": 64}), ("png", {"colors": 16}),
+               ("webp", {"quality": 85}), ("webp", {"quality": 70}),
+               ("jpeg", {"quality": 85}), ("jpeg", {"quality": 70})]
+    originals = []
+    for path in paths:
+        with open(path, "rb") as file:
+            originals.append(file.read())
+    total_in = sum(len(data) for data in originals)
+    print(f"{len(originals)} receipts, {total_in} bytes as rendered")
+    for format, params in options:
+        encoder = ImageEncoder(format, **params)
+        total_out = sum(len(encoder._fit(Image.open(io.BytesIO(data)))) for data in originals)
+        label = format + "".join(f" {key}={value}" for key, value in params.items())
+        print(f"  {label:<24} {total_out:>10} bytes  {100 * (1 - total_out / total_in):5.1f}% saved")
+
+if __name__ == "__main__":
+    report(sys.argv[1:])
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from structured_log import get_logger
+
+log = get_logger("job_queue")
+
+# In-process job queue drained by a pool of worker threads.
+# The webhook only has to enqueue the receipt and return; rendering and the
+# Telegram upload happen on the workers. Threads are started on the first
+# submit, and again in any process forked after that, so each gunicorn
+# worker owns its own pool.
+class JobQueue:
+    def __init__(self, workers=1, maxsize=100, name="jobs", history=500, on_finish=None):
+        self.workers = workers
+        self.name = name
+        self.on_finish = on_finish  # optional callback(wait_seconds, latency_seconds, ok) per job
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._waits = deque(maxlen=history)      # seconds spent queued
+        self._latencies = deque(maxlen=history)  # seconds from submit to finish
+
+    def start(self):
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            # Threads do not survive fork(); a child starts with a fresh queue
+            if self._pid is not None and self._pid != os.getpid():
+                self._queue = queue.Queue(self._queue.maxsize)
+                self._busy = 0
+            self._threads = []
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # Queue func(*args, **kwargs); returns False when the queue is full
+    def submit(self, func, *args, **kwargs):
+        self.start()
+        try:
+            self._queue.put_nowait((time.monotonic(), func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._counts["rejected"] += 1
+            return False
+        with self._lock:
+            self._counts["submitted"] += 1
+        return True
+
+    def _worker(self):
+        while True:
+            queued_at, func, args, kwargs = self._queue.get()
+            started_at = time.monotonic()
+            with self._lock:
+                self._busy += 1
+            ok = True
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                ok = False
+                log.exception("job_failed", queue=self.name, job=getattr(func, "__name__", repr(func)))
+            finally:
+                finished_at = time.monotonic()
+                with self._lock:
+                    self._busy -= 1
+                    self._counts["completed" if ok else "failed"] += 1
+                    self._waits.append(started_at - queued_at)
+                    self._latencies.append(finished_at - queued_at)
+                if self.on_finish is not None:
+                    self.on_finish(started_at - queued_at, finished_at - queued_at, ok)
+                self._queue.task_done()
+
+    # Block until every queued job has finished
+    def join(self):
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            latencies = sorted(self._latencies)
+            stats = dict(self._counts)
+            stats.update({
+                "depth": self._queue.qsize(),
+                "workers": self.workers,
+                "busy": self._busy,
+            })
+        stats["wait_ms"] = _summary(waits)
+        stats["latency_ms"] = _summary(latencies)
+        return stats
+
+
+def _percentile(values, pct):
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _summary(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "p50": round(_percentile(values, 50) * 1000, 1),
+        "p95": round(_percentile(values, 95) * 1000, 1),
+        "max": round(values[-1] * 1000, 1),
+    }
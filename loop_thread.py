@@ -0,0 +1,55 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import TimeoutError
+
+# One asyncio event loop running for the life of the process on a daemon
+# thread. Async resources tied to a loop, like the pyppeteer browser and its
+# page pool, live on it, and any thread hands it coroutines with submit() or
+# run(), so renders from every request and worker thread are in flight
+# together instead of each call building and tearing down its own loop.
+# Started on first use, and again in a forked child, whose copy of the parent's
+# loop has no thread behind it.
+class LoopThread:
+    def __init__(self, name="asyncio"):
+        self.name = name
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+
+                threading.Thread(target=run, name=self.name, daemon=True).start()
+                started.wait()
+                self._loop = loop
+                self._pid = os.getpid()
+            return self._loop
+
+    # Schedule a coroutine on the loop; returns a concurrent.futures.Future
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure())
+
+    # Run a coroutine on the loop and wait for its result (cancelled on timeout)
+    def run(self, coroutine, timeout=None):
+        future = self.submit(coroutine)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self):
+        with self._lock:
+            loop = self._loop if self._pid == os.getpid() else None
+            self._loop, self._pid = None, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,114 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from structured_log import get_logger
+
+log = get_logger("loyverse_client")
+
+# Loyverse API client for everything that reads back from Loyverse (backfill,
+# reconciliation): one pooled, kept-alive session per process, bounded
+# retries with jittered backoff on network errors and 5xx, Retry-After
+# honoured on 429, and cursor pagination over the list endpoints.
+BASE_URL = "https://api.loyverse.com/v1.0"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+PAGE_LIMIT = 250  # the most Loyverse returns per page
+
+class LoyverseClient:
+    def __init__(self, token, pool_size=4, max_retries=4, backoff=0.5, max_backoff=30.0, timeout=(5, 30)):
+        self.token = token
+        self.pool_size = pool_size      # kept-alive connections
+        self.max_retries = max_retries  # attempts after the first one
+        self.backoff = backoff          # seconds, doubled per attempt before jitter
+        self.max_backoff = max_backoff
+        self.timeout = timeout          # (connect, read) seconds
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._counts = {"requests": 0, "failed": 0, "retries": 0, "rate_limited": 0}
+
+    # Session is per process, recreated after a fork
+    def _get_session(self):
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                session.headers["Authorization"] = f"Bearer {self.token}"
+                self._session = session
+                self._pid = os.getpid()
+            return self._session
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counts[key] += amount
+
+    # Seconds to wait before the given retry (0-based), with full jitter
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    # GET an API path and return the decoded JSON; raises once retries are used up
+    def get(self, path, params=None):
+        session = self._get_session()
+        url = f"{BASE_URL}/{path.lstrip('/')}"
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            self._count("requests")
+            try:
+                response = session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                log.warning("loyverse_request_failed", path=path, attempt=attempt + 1, error=str(e))
+                if last:
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                time.sleep(self._delay(attempt))
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            log.warning("loyverse_request_failed", path=path, attempt=attempt + 1,
+                        status=response.status_code, body=response.text)
+            if response.status_code not in RETRY_STATUSES or last:
+                self._count("failed")
+                response.raise_for_status()
+            self._count("retries")
+            if response.status_code == 429:
+                self._count("rate_limited")
+                time.sleep(_retry_after(response) + random.uniform(0, self.backoff))
+            else:
+                time.sleep(self._delay(attempt))
+
+    # Every item of a list endpoint (e.g. "receipts" -> response["receipts"]),
+    # following the cursor page by page; pages are fetched as the caller iterates
+    def paginate(self, path, key, params=None):
+        params = {"limit": PAGE_LIMIT, **(params or {})}
+        while True:
+            page = self.get(path, params)
+            yield from page.get(key, [])
+            cursor = page.get("cursor")
+            if not cursor:
+                return
+            params = {**params, "cursor": cursor}
+
+    # Receipts created in [created_at_min, created_at_max] (ISO 8601, UTC)
+    def receipts(self, created_at_min=None, created_at_max=None, **params):
+        if created_at_min:
+            params["created_at_min"] = created_at_min
+        if created_at_max:
+            params["created_at_max"] = created_at_max
+        return self.paginate("receipts", "receipts", params)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+# Seconds asked for by a 429's Retry-After header
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        return 1.0
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus metrics: counters, histograms and scrape-time gauges,
+# rendered in the text exposition format for GET /metrics. Values live in
+# the worker process; every series carries a worker="<pid>" label so the
+# per-worker series of a multi-worker gunicorn can be summed in queries.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Counter names end in _total, as the text format expects
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        labels = tuple(map(str, labels))
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self, worker):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, labels, [worker])} {_number(value)}"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        labels = tuple(map(str, labels))
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # Time the body of a `with` block
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self, worker):
+        with self._lock:
+            values = {labels: list(series) for labels, series in self._values.items()}
+        for labels, series in sorted(values.items()):
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-2] + [series[-1]]):
+                extra = [worker, ("le", _number(bound))]
+                yield f"{self.name}_bucket{_labels(self.labels, labels, extra)} {count}"
+            yield f"{self.name}_sum{_labels(self.labels, labels, [worker])} {_number(series[-2])}"
+            yield f"{self.name}_count{_labels(self.labels, labels, [worker])} {series[-1]}"
+
+# Value read at scrape time, e.g. a queue depth; func returns a number or
+# a {label value tuple: number} dict
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, func, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.func = func
+
+    def samples(self, worker):
+        value = self.func()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, number in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, labels, [worker])} {_number(number)}"
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, func, labels=()):
+        return self._add(Gauge(name, help, func, labels))
+
+    def render(self):
+        worker = ("worker", str(os.getpid()))
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(worker))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,321 @@
+import io
+import os
+import threading
+from datetime import datetime
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from assets import assets
+from structured_log import get_logger
+
+log = get_logger("native_renderer")
+
+# Draws the receipt from receipt_template.html straight onto a Pillow image:
+# no browser, no wkhtmltoimage subprocess. Fonts, text metrics, rendered text,
+# the logo bitmap and the dotted rule are cached, so a render is mostly pastes.
+
+# Store details, kept in step with receipt_template.html
+STORE_NAME = "Chic Opulance"
+LOGO_URL = "https://data-prod-eu-loyverse-com.s3.amazonaws.com/outlets/3279808/profile/emailLogo2024-07-23-09-19-35-035.png"
+FOOTER_LINES = ["Thank You!", "BML Transfer: 7730000465147", "Account Name: SM Shop", "Viber/Telegram: 7620064"]
+MADE_BY = "made by @shahulyns.bot ♥"
+
+# Logo file or URL and output scale (1.0 = CSS pixels)
+RECEIPT_LOGO = os.getenv("RECEIPT_LOGO", LOGO_URL)
+NATIVE_RENDER_SCALE = float(os.getenv("NATIVE_RENDER_SCALE", "1.0"))
+
+# Colours and box metrics taken from the template's CSS, in CSS pixels
+PAGE_BG = (245, 245, 245)
+CARD_BG = (255, 255, 255)
+TEXT = (0, 0, 0)
+MUTED = (102, 102, 102)
+RULE = (170, 170, 170)
+PAGE_PADDING = 20
+CARD_PADDING = 20
+CARD_WIDTH = 400
+CARD_RADIUS = 8
+SHADOW = 5
+LOGO_HEIGHT = 80
+LINE_HEIGHT = 1.2
+
+# Roboto first (as in the template), then common system fallbacks
+FONT_CANDIDATES = {
+    False: [
+        os.getenv("RECEIPT_FONT"),
+        "Roboto-Regular.ttf",
+        "/usr/share/fonts/truetype/roboto/unhinted/RobotoTTF/Roboto-Regular.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "DejaVuSans.ttf",
+    ],
+    True: [
+        os.getenv("RECEIPT_FONT_BOLD"),
+        "Roboto-Bold.ttf",
+        "/usr/share/fonts/truetype/roboto/unhinted/RobotoTTF/Roboto-Bold.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "DejaVuSans-Bold.ttf",
+    ],
+}
+
+# FreeType faces are shared between render threads but are not thread-safe,
+# so every call that touches a face goes through this lock. The results are
+# cached, so warm renders hardly ever take it.
+_freetype_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _font(size, bold=False):
+    # The asset cache's Roboto goes ahead of the system fallbacks (only if it
+    # is already on disk; _check_assets() drops this cache when it arrives)
+    candidates = FONT_CANDIDATES[bold][:1] + [assets.font_path(bold)] + FONT_CANDIDATES[bold][1:]
+    for path in candidates:
+        if not path:
+            continue
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+@lru_cache(maxsize=8192)
+def _text_width(text, size, bold=False):
+    font = _font(size, bold)
+    with _freetype_lock:
+        return font.getlength(text)
+
+@lru_cache(maxsize=None)
+def _font_metrics(size, bold=False):
+    font = _font(size, bold)
+    with _freetype_lock:
+        return font.getmetrics()
+
+# Greedy word wrap, breaking inside words that are wider than the column
+@lru_cache(maxsize=4096)
+def _wrap(text, max_width, size, bold=False):
+    lines = []
+    line = ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if _text_width(candidate, size, bold) <= max_width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = ""
+        for char in word:
+            if line and _text_width(line + char, size, bold) > max_width:
+                lines.append(line)
+                line = ""
+            line += char
+    lines.append(line)
+    return tuple(lines)
+
+# Rasterised text as an alpha mask plus its offset from the anchor point;
+# receipts repeat most strings (headings, footer, prices), so glyph
+# rendering is skipped for anything drawn before.
+@lru_cache(maxsize=4096)
+def _text_mask(text, size, bold, anchor):
+    font = _font(size, bold)
+    with _freetype_lock:
+        left, top, right, bottom = font.getbbox(text, anchor=anchor)
+        mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, anchor=anchor)
+    return mask, left, top
+
+# Dotted 1px rule, built once per width and pasted onto every receipt
+@lru_cache(maxsize=8)
+def _rule_strip(width, thickness):
+    strip = Image.new("RGB", (width, thickness), CARD_BG)
+    draw = ImageDraw.Draw(strip)
+    for x in range(0, width, thickness * 2):
+        draw.rectangle([x, 0, x + thickness - 1, thickness - 1], fill=RULE)
+    return strip
+
+_logos = {}
+_logo_missing = set()
+_logo_lock = threading.Lock()
+_assets_version = None
+
+def _load_logo_source(source):
+    if source.startswith(("http://", "https://")):
+        data = assets.logo_png(source)
+        if data is None:
+            raise OSError("not in the asset cache")
+        return Image.open(io.BytesIO(data))
+    return Image.open(source)
+
+# Logo scaled to the requested height. A missing logo costs one warning, not
+# one per render, and is looked for again once the asset cache changes.
+def _logo(height):
+    with _logo_lock:
+        if height in _logos:
+            return _logos[height]
+        if height in _logo_missing:
+            return None
+        try:
+            image = _load_logo_source(RECEIPT_LOGO).convert("RGBA")
+        except Exception as e:
+            _logo_missing.add(height)
+            log.warning("logo_unavailable", logo=RECEIPT_LOGO, error=str(e))
+            return None
+        width = max(1, round(image.width * height / image.height))
+        _logos[height] = image.resize((width, height), Image.LANCZOS)
+        return _logos[height]
+
+# Renders never download: fonts and the logo come from whatever the asset
+# cache holds, with fallbacks until the background retry fetches the rest.
+# When it does (assets.version moves), drop everything built on a fallback.
+def _check_assets():
+    global _assets_version
+    if assets.version == _assets_version:
+        return
+    with _logo_lock:
+        version = assets.version
+        if version == _assets_version:
+            return
+        for cached in (_font, _text_width, _font_metrics, _wrap, _text_mask):
+            cached.cache_clear()
+        _logos.clear()
+        _logo_missing.clear()
+        _assets_version = version
+
+# Collects positioned draw operations while walking down the card, so the
+# image can be allocated at exactly the content height before drawing.
+class _Layout:
+    def __init__(self, scale):
+        self.scale = scale
+        self.width = self.px(CARD_WIDTH)
+        self.y = 0
+        self.ops = []
+
+    def px(self, value):
+        return round(value * self.scale)
+
+    def space(self, value):
+        self.y += self.px(value)
+
+    def _line(self, size, bold):
+        ascent, descent = _font_metrics(size, bold)
+        line_height = max(round(size * LINE_HEIGHT), ascent + descent)
+        baseline = self.y + (line_height - ascent - descent) // 2 + ascent
+        return line_height, baseline
+
+    def centered(self, text, size, bold=False, color=TEXT):
+        size = self.px(size)
+        for line in _wrap(text, self.width, size, bold):
+            line_height, baseline = self._line(size, bold)
+            self.ops.append(("text", self.width // 2, baseline, line, size, bold, color, "ms"))
+            self.y += line_height
+
+    # Left/right pair, like the template's flex rows with space-between
+    def split(self, left, right, size, bold=False, color=TEXT):
+        size = self.px(size)
+        right_width = _text_width(right, size, bold)
+        left_width = max(self.px(40), self.width - right_width - self.px(10))
+        lines = _wrap(left, int(left_width), size, bold)
+        for index, line in enumerate(lines):
+            line_height, baseline = self._line(size, bold)
+            self.ops.append(("text", 0, baseline, line, size, bold, color, "ls"))
+            if index == 0 and right:
+                self.ops.append(("text", self.width, baseline, right, size, bold, color, "rs"))
+            self.y += line_height
+
+    def rule(self):
+        self.space(8)
+        self.ops.append(("rule", 0, self.y))
+        self.y += max(1, self.px(1))
+        self.space(8)
+
+    def logo(self):
+        logo = _logo(self.px(LOGO_HEIGHT))
+        if logo is not None:
+            self.ops.append(("image", (self.width - logo.width) // 2, self.y, logo))
+            self.y += logo.height
+            self.space(10)
+
+def _money(value):
+    return f"MVR {value:.2f}"
+
+# Lay out a receipt at the given scale; draw() turns the result into an image
+def build_layout(receipt_data, scale, server_time=None):
+    _check_assets()
+    total_amount = receipt_data.get("total_money", 0)
+    layout = _Layout(scale)
+
+    layout.logo()
+    layout.space(5)
+    layout.centered(STORE_NAME, 15, bold=True)
+    layout.space(5)
+    layout.rule()
+    layout.space(5)
+    layout.centered(_money(total_amount), 24, bold=True)
+    layout.space(5)
+    layout.centered("Total", 16, color=MUTED)
+    layout.space(10)
+    layout.rule()
+    layout.split(f"Employee: {receipt_data.get('employee_name') or receipt_data.get('employee_id', 'N/A')}", "", 14, color=MUTED)
+    layout.space(5)
+    layout.split(f"POS:{receipt_data.get('store_name') or receipt_data.get('store_id', 'N/A')}", "", 14, color=MUTED)
+    layout.space(5)
+    layout.rule()
+
+    for item in receipt_data.get("line_items", []):
+        item_name = item.get("item_name", "Item")
+        quantity = item.get("quantity", 0)
+        unit_price = item.get("price", 0)
+        layout.space(5)
+        layout.split(item_name, _money(quantity * unit_price), 16)
+        layout.space(5)
+        layout.split(f"{quantity} × {_money(unit_price)}", "", 14, color=MUTED)
+        layout.space(5)
+
+    layout.rule()
+    layout.space(5)
+    layout.split("Total", _money(total_amount), 16, bold=True)
+    layout.space(5)
+    payments = receipt_data.get("payments") or [{"name": "Transfer", "money_amount": total_amount}]
+    for payment in payments:
+        layout.space(5)
+        layout.split(payment.get("name", "Payment"), _money(payment.get("money_amount", 0)), 16)
+        layout.space(5)
+    layout.rule()
+
+    layout.space(5)
+    for line in FOOTER_LINES:
+        layout.centered(line, 14, color=MUTED)
+    layout.space(5)
+    layout.split(server_time or datetime.now().strftime("%d/%m/%Y %H:%M"), f"Receipt № {receipt_data.get('receipt_number', 'N/A')}", 14, color=MUTED)
+    layout.space(10)
+    layout.centered(MADE_BY, 10, color=MUTED)
+    layout.space(5)
+    return layout
+
+# Rasterise a finished layout
+def draw(layout):
+    page_padding = layout.px(PAGE_PADDING)
+    card_padding = layout.px(CARD_PADDING)
+    card_width = layout.width + 2 * card_padding
+    card_height = layout.y + 2 * card_padding
+    image = Image.new("RGB", (card_width + 2 * page_padding, card_height + 2 * page_padding), PAGE_BG)
+    draw = ImageDraw.Draw(image)
+
+    # Soft box-shadow: 1px rounded rings fading out from the card edge
+    card_box = [page_padding, page_padding, page_padding + card_width - 1, page_padding + card_height - 1]
+    radius = layout.px(CARD_RADIUS)
+    for ring in range(layout.px(SHADOW), 0, -1):
+        shade = PAGE_BG[0] - round(12 * (1 - ring / (layout.px(SHADOW) + 1)))
+        grown = [card_box[0] - ring, card_box[1] - ring, card_box[2] + ring, card_box[3] + ring]
+        draw.rounded_rectangle(grown, radius=radius + ring, outline=(shade, shade, shade), width=1)
+    draw.rounded_rectangle(card_box, radius=radius, fill=CARD_BG)
+
+    origin_x = page_padding + card_padding
+    origin_y = page_padding + card_padding
+    rule = _rule_strip(layout.width, max(1, layout.px(1)))
+    for op in layout.ops:
+        if op[0] == "text":
+            _, x, y, text, size, bold, color, anchor = op
+            mask, left, top = _text_mask(text, size, bold, anchor)
+            image.paste(color, (origin_x + x + left, origin_y + y + top), mask)
+        elif op[0] == "rule":
+            image.paste(rule, (origin_x + op[1], origin_y + op[2]))
+        elif op[0] == "image":
+            _, x, y, logo = op
+            image.paste(logo, (origin_x + x, origin_y + y), logo)
+    return image
@@ -0,0 +1,168 @@
+import asyncio
+import math
+from pyppeteer import launch
+from structured_log import get_logger
+
+log = get_logger("page_pool")
+
+# Long-lived headless Chromium with a small pool of reusable pages.
+# Each render borrows a page, sets its content, screenshots it and hands it
+# back; pages are reset between renders and replaced after max_renders uses
+# so a leaky page never lives forever. The pool must always be used from the
+# same event loop that started it.
+class PagePool:
+    def __init__(self, executable_path="/usr/bin/chromium-browser", size=2, max_renders=100, args=None):
+        self.executable_path = executable_path
+        self.size = size
+        self.max_renders = max_renders
+        self.args = args or ["--no-sandbox", "--disable-setuid-sandbox"]
+        self._browser = None
+        self._pages = None
+        self._uses = {}
+        self._lock = None
+        self._generation = 0  # bumped on every launch
+
+    # Launch the browser and open the pages (no-op once started)
+    async def start(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            # One queue for the life of the pool: renders waiting in acquire()
+            # are woken by the pages of whichever browser comes up next
+            self._pages = asyncio.Queue()
+        async with self._lock:
+            if self._browser is None:
+                await self._launch()
+
+    # Caller holds self._lock
+    async def _launch(self):
+        # Pages of an earlier browser still sitting in the queue are dead
+        while not self._pages.empty():
+            self._pages.get_nowait()
+        self._uses.clear()
+        # The pool runs on LoopThread's daemon thread, where signal.signal()
+        # raises; and gunicorn owns SIGINT/SIGTERM/SIGHUP anyway
+        self._browser = await launch(
+            executablePath=self.executable_path,
+            headless=True,
+            args=self.args,
+            handleSIGINT=False,
+            handleSIGTERM=False,
+            handleSIGHUP=False,
+        )
+        self._generation += 1
+        for _ in range(self.size):
+            self._pages.put_nowait(await self._new_page())
+
+    async def _new_page(self):
+        page = await self._browser.newPage()
+        self._uses[page] = 0
+        return page
+
+    # Throw away the browser after a crash and start a fresh one. Several
+    # pages of the same browser can fail together; only the first relaunches.
+    async def _restart(self, generation):
+        async with self._lock:
+            if generation != self._generation:
+                return
+            browser = self._browser
+            self._browser = None
+            if browser is not None:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+            try:
+                await self._launch()
+            except Exception as e:
+                # Left stopped; the next acquire() tries again
+                self._browser = None
+                log.error("browser_relaunch_failed", error=str(e))
+
+    async def acquire(self):
+        await self.start()
+        return await self._pages.get()
+
+    async def release(self, page, failed=False):
+        if page not in self._uses:
+            # Page belonged to a browser that has since been relaunched
+            return
+        generation = self._generation
+        uses = self._uses.pop(page) + 1
+        try:
+            if failed or uses >= self.max_renders:
+                await page.close()
+                page = await self._new_page()
+            else:
+                # Blank the page so nothing from the last receipt leaks into the next one
+                await page.goto("about:blank")
+                self._uses[page] = uses
+        except Exception as e:
+            log.warning("browser_relaunch", error=str(e))
+            await self._restart(generation)
+            return
+        self._pages.put_nowait(page)
+
+    # Render an HTML string and return the screenshot (or write it to options["path"]).
+    # With a selector only that element's bounding box is captured, so the image
+    # is exactly as tall as the content instead of the whole page.
+    async def screenshot(self, html, options=None, selector=None):
+        page = await self.acquire()
+        failed = False
+        try:
+            await page.setContent(html)
+            await page.waitForFunction(
+                "() => Array.from(document.images).every(img => img.complete)",
+                {"timeout": 10000}
+            )
+            options = dict(options or {})
+            clip = await self._clip(page, selector) if selector else None
+            if clip is not None:
+                options.pop("fullPage", None)
+                options["clip"] = clip
+            elif "clip" not in options:
+                options.setdefault("fullPage", True)
+            return await page.screenshot(options)
+        except BaseException:
+            # Includes cancellation on timeout: the page may be mid-render
+            failed = True
+            raise
+        finally:
+            await self.release(page, failed)
+
+    # Page-relative box of the first element matching selector, with the
+    # viewport grown to hold it (clips outside the viewport come back blank)
+    async def _clip(self, page, selector):
+        box = await page.evaluate(
+            """(selector) => {
+                const element = document.querySelector(selector);
+                if (!element) return null;
+                const rect = element.getBoundingClientRect();
+                return {x: rect.left + window.scrollX, y: rect.top + window.scrollY,
+                        width: rect.width, height: rect.height};
+            }""",
+            selector,
+        )
+        if not box:
+            return None
+        viewport = page.viewport or {"width": 800, "height": 600}
+        needed = {"width": max(viewport["width"], math.ceil(box["x"] + box["width"])),
+                  "height": max(viewport["height"], math.ceil(box["y"] + box["height"]))}
+        if needed != {"width": viewport["width"], "height": viewport["height"]}:
+            await page.setViewport({**viewport, **needed})
+        return box
+
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+            self._uses.clear()
+            while not self._pages.empty():
+                self._pages.get_nowait()
+
+    def stats(self):
+        return {
+            "running": self._browser is not None,
+            "size": self.size,
+            "idle": self._pages.qsize() if self._pages is not None else 0,
+            "max_renders": self.max_renders,
+        }
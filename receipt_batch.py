@@ -0,0 +1,44 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# Shared render pool, created on first use and recreated in a forked child,
+# whose copy of the parent's pool has no threads behind it
+def _get_executor(max_workers):
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+            _executor_pid = os.getpid()
+        return _executor
+
+# Result for one receipt of a webhook payload
+def _result(receipt_data, image=None, error=None):
+    return {
+        "receipt_number": receipt_data.get("receipt_number", "N/A"),
+        "ok": image is not None,
+        "image": image,
+        "error": error,
+    }
+
+def _render_one(render, receipt_data):
+    try:
+        image = render(receipt_data)
+    except Exception as e:
+        return _result(receipt_data, error=str(e))
+    if image is None:
+        return _result(receipt_data, error="renderer returned no image")
+    return _result(receipt_data, image=image)
+
+# Render every receipt in the payload concurrently with render(receipt_data).
+# Results come back in payload order so Telegram delivery keeps sale order.
+def render_receipts(receipts, render, max_workers=4):
+    if len(receipts) == 1:
+        return [_render_one(render, receipts[0])]
+    executor = _get_executor(max_workers)
+    futures = [executor.submit(_render_one, render, receipt_data) for receipt_data in receipts]
+    return [future.result() for future in futures]
@@ -0,0 +1,200 @@
+import html
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from structured_log import get_logger
+
+log = get_logger("receipt_template")
+
+# Receipt HTML from receipt_template.html, compiled once instead of being
+# rebuilt on every call. The file uses {{ name }} placeholders, plus
+# <!-- line_item --> ... <!-- /line_item --> and <!-- payment --> ... <!-- /payment -->
+# blocks that are repeated per line item / payment. Compiling splits the
+# document into static fragments and slot names and turns each block into a
+# compiled f-string function, so a render only fills slots and does one
+# "".join. The file is reloaded when its mtime changes.
+# RECEIPT_TEMPLATE picks another store's layout, e.g. templates/sm_shop.html
+# (relative paths are taken from this directory).
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.getenv("RECEIPT_TEMPLATE", "receipt_template.html"))
+
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+_BLOCK = re.compile(r"<!--\s*(\w+)\s*-->(.*?)<!--\s*/\1\s*-->", re.S)
+
+# Split text into (fragments, slots): fragments[i] comes before slots[i]
+def _compile(text):
+    parts = _PLACEHOLDER.split(text)
+    return parts[0::2], parts[1::2]
+
+# Slots that hold money and are formatted with two decimals inside the template
+_MONEY_SLOTS = {"total_amount", "unit_price", "line_total", "amount_paid"}
+
+# Every slot a template may use: the document's own (logo_src and font_css
+# are usually filled in as constants), and each repeated block's, in the
+# order the block function takes them
+MAIN_SLOTS = ("logo_src", "font_css", "total_amount", "employee_id", "store_id", "employee_name",
+              "store_name", "receipt_number", "server_time")
+BLOCK_SLOTS = {
+    "line_item": ("item_name", "quantity", "unit_price", "line_total"),
+    "payment": ("payment_name", "amount_paid"),
+}
+
+def _check_slots(path, where, slots, allowed):
+    unknown = sorted(set(slots) - set(allowed))
+    if unknown:
+        raise ValueError(
+            f"{path}: unknown slot(s) {', '.join(unknown)} in {where}; "
+            f"allowed: {', '.join(allowed)}"
+        )
+
+def _fstring(text):
+    return "f" + repr(text.replace("{", "{{").replace("}", "}}"))
+
+# Repeated blocks are compiled into a Python function built around a single
+# f-string, so filling a row costs the same as the hand-written f-strings did.
+# The function takes every slot the block may use, whether or not this
+# template prints it.
+def _compile_block(text, args):
+    fragments, slots = _compile(text)
+    pieces = []
+    for fragment, slot in zip(fragments, slots):
+        pieces.append(_fstring(fragment))
+        pieces.append("f'{" + slot + (":.2f" if slot in _MONEY_SLOTS else "") + "}'")
+    pieces.append(_fstring(fragments[-1]))
+    source = f"lambda {', '.join(args)}: " + " ".join(pieces)
+    return eval(compile(source, "<receipt_template>", "eval"), {})
+
+_NEEDS_ESCAPE = re.compile(r"[&<>\"']")
+
+def _escape(value):
+    text = str(value)
+    return html.escape(text) if _NEEDS_ESCAPE.search(text) else text
+
+def _money(value):
+    return f"{value:.2f}"
+
+class ReceiptTemplate:
+    def __init__(self, path=TEMPLATE_PATH, check_interval=1.0, constants=None):
+        self.path = path
+        # dict, or a callable returning one; a callable is re-checked with the
+        # file, so the template is recompiled once e.g. a late logo download lands
+        self.constants = constants
+        self.check_interval = check_interval  # seconds between mtime checks
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._compiled = None
+        self._constants = None
+        self._load()
+
+    def _current_constants(self):
+        return self.constants() if callable(self.constants) else (self.constants or {})
+
+    def _load(self, constants=None):
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as file:
+            text = file.read()
+        if constants is None:
+            constants = self._current_constants()
+        text = _PLACEHOLDER.sub(lambda match: constants.get(match.group(1), match.group(0)), text)
+        blocks = {}
+
+        # Each block becomes a single slot of the same name in the main template.
+        # Slot names are checked here, so a typo fails the load, not every render.
+        def cut_block(match):
+            name, body = match.group(1), match.group(2)
+            if name not in BLOCK_SLOTS:
+                raise ValueError(f"{self.path}: unknown block <!-- {name} -->; allowed: {', '.join(BLOCK_SLOTS)}")
+            _check_slots(self.path, f"<!-- {name} --> block", _compile(body)[1], BLOCK_SLOTS[name])
+            blocks[name] = _compile_block(body, BLOCK_SLOTS[name])
+            return "{{ " + name + " }}"
+
+        main = _compile(_BLOCK.sub(cut_block, text))
+        _check_slots(self.path, "the template", main[1], MAIN_SLOTS + tuple(constants) + tuple(BLOCK_SLOTS))
+        # Swapped in one assignment so a concurrent render never mixes old and new pieces
+        self._compiled = (main, blocks)
+        self._constants = constants
+        self._mtime = mtime
+
+    # Reload the template if the file or its constants changed (checked at
+    # most every check_interval). Renders never queue up behind a check: while
+    # one thread is checking, the others keep using the compiled template.
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            mtime = os.stat(self.path).st_mtime
+            constants = self._current_constants() if callable(self.constants) else self._constants
+            if mtime != self._mtime or constants != self._constants:
+                try:
+                    self._load(constants)
+                except ValueError:
+                    # Not retried until the file or its constants change again
+                    self._mtime, self._constants = mtime, constants
+                    raise
+                log.info("template_reloaded", path=self.path)
+        except (OSError, ValueError) as e:
+            # Keep rendering with the last good template
+            log.warning("template_reload_failed", path=self.path, error=str(e))
+        finally:
+            self._lock.release()
+
+    def render(self, receipt_data, server_time=None):
+        self._refresh()
+        main, blocks = self._compiled
+        total_amount = receipt_data.get("total_money", 0)
+
+        values = {
+            "total_amount": _money(total_amount),
+            "employee_id": _escape(receipt_data.get("employee_id", "N/A")),
+            "store_id": _escape(receipt_data.get("store_id", "N/A")),
+            # Names filled in by ReferenceData.annotate, else the raw ids
+            "employee_name": _escape(receipt_data.get("employee_name") or receipt_data.get("employee_id", "N/A")),
+            "store_name": _escape(receipt_data.get("store_name") or receipt_data.get("store_id", "N/A")),
+            "receipt_number": _escape(receipt_data.get("receipt_number", "N/A")),
+            "server_time": server_time or datetime.now().strftime("%d/%m/%Y %H:%M"),
+        }
+
+        line_item = blocks.get("line_item")
+        if line_item is not None:
+            rows = []
+            for item in receipt_data.get("line_items", []):
+                quantity = item.get("quantity", 0)
+                unit_price = item.get("price", 0)
+                rows.append(line_item(
+                    item_name=_escape(item.get("item_name", "Item")),
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    line_total=quantity * unit_price,
+                ))
+            values["line_item"] = rows
+
+        payment = blocks.get("payment")
+        if payment is not None:
+            # Receipts without a payment breakdown show the whole total as a transfer
+            payments = receipt_data.get("payments") or [{"name": "Transfer", "money_amount": total_amount}]
+            values["payment"] = [payment(
+                payment_name=_escape(entry.get("name", "Payment")),
+                amount_paid=entry.get("money_amount", 0),
+            ) for entry in payments]
+
+        # Everything goes into one list so the whole receipt is a single join
+        out = []
+        fragments, slots = main
+        for fragment, slot in zip(fragments, slots):
+            out.append(fragment)
+            value = values.get(slot, "")
+            if isinstance(value, list):
+                out.extend(value)
+            else:
+                out.append(value)
+        out.append(fragments[-1])
+        return "".join(out)
@@ -0,0 +1,158 @@
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from structured_log import get_logger
+
+log = get_logger("reconciler")
+
+# Catches sales whose webhook never arrived (VPS or gunicorn down, network
+# trouble). Every poll lists the receipts created since a high-water mark,
+# claims the ones nobody has delivered or is still handling, and hands them
+# to the render pipeline like a webhook would; the mark then moves up to the
+# end of the polled window. A receipt another live process holds is left
+# alone; one whose owner has died, or whose claim outlived claim_timeout, is
+# claimed again, so a restart does not strand receipts it had not delivered.
+# The newest `grace` seconds are left to the webhook, and each window starts
+# `overlap` seconds before the mark to pick up receipts that a POS synced
+# late. The mark lives in the shared ledger, and a lease there lets just one
+# gunicorn worker poll at a time (another takes over if it dies). Polling is
+# frequent while the store is open (plus a tail after closing) and slows
+# down, until the next opening, while it is shut.
+MARK = "reconciler_high_water"
+LEASE = "reconciler"
+
+# "09:00-23:00" or "09:00-13:00,15:00-02:00" (local time) -> [(start, end)] in minutes
+def parse_hours(text):
+    ranges = []
+    for part in (text or "").split(","):
+        if not part.strip():
+            continue
+        start, end = (datetime.strptime(value.strip(), "%H:%M") for value in part.split("-"))
+        ranges.append((start.hour * 60 + start.minute, end.hour * 60 + end.minute))
+    return ranges
+
+def _iso(moment):
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+def _parse_iso(text):
+    return datetime.fromisoformat(text.replace("Z", "+00:00"))
+
+class Reconciler:
+    def __init__(self, loyverse, ledger, submit, open_hours=None, open_interval=60, closed_interval=900,
+                 grace=120, overlap=3600, lookback=0, tail=1800):
+        self.loyverse = loyverse
+        self.ledger = ledger
+        self.submit = submit                    # submit(receipts) -> False if the pipeline is full
+        self.open_hours = parse_hours(open_hours) if isinstance(open_hours, str) else (open_hours or [])
+        self.open_interval = open_interval      # seconds between polls while open
+        self.closed_interval = closed_interval  # longest wait while closed
+        self.grace = grace                      # newest seconds left to the webhook
+        self.overlap = overlap                  # seconds re-checked before the mark
+        self.lookback = lookback                # seconds covered by the very first poll
+        self.tail = tail                        # seconds after closing still treated as open
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {"polls": 0, "found": 0, "failures": 0, "leader": False, "last_poll": None, "interval": None}
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+        threading.Thread(target=self._run, name="reconciler", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # The first poll waits one interval, so it never races worker warm-up
+        interval = self.interval(datetime.now())
+        while not self._stop.wait(interval):
+            found = 0
+            try:
+                found = self.poll() or 0
+            except Exception as e:
+                with self._lock:
+                    self._stats["failures"] += 1
+                log.warning("reconcile_failed", error=str(e))
+            interval = self.interval(datetime.now(), found)
+            with self._lock:
+                self._stats["interval"] = round(interval)
+
+    @property
+    def owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    # One reconciliation pass; returns how many missed receipts were queued,
+    # or None when another worker holds the lease
+    def poll(self):
+        ttl = 2 * max(self.open_interval, self.closed_interval) + 60
+        leader = self.ledger.acquire_lease(LEASE, self.owner, ttl)
+        with self._lock:
+            self._stats["leader"] = leader
+        if not leader:
+            return None
+
+        until = datetime.now(timezone.utc) - timedelta(seconds=self.grace)
+        mark = self.ledger.get_mark(MARK)
+        if mark is None and not self.lookback:
+            # First run: start watching from now rather than replaying history
+            self.ledger.set_mark(MARK, _iso(until))
+            return 0
+        since = (_parse_iso(mark) - timedelta(seconds=self.overlap)) if mark else until - timedelta(seconds=self.lookback)
+
+        receipts = [
+            receipt_data for receipt_data in self.loyverse.receipts(_iso(since), _iso(until))
+            if not receipt_data.get("cancelled_at")
+        ]
+        # Oldest first, so missed sales reach Telegram in the order they were made
+        receipts.sort(key=lambda receipt_data: receipt_data.get("created_at") or "")
+        missing = self.ledger.claim_unhandled(receipts)
+        if missing:
+            if not self.submit(missing):
+                # Pipeline is full: leave the mark where it is and try again next poll
+                self.ledger.release_all(missing)
+                log.warning("reconcile_deferred", receipts=len(missing))
+                return 0
+            log.info("reconciled_missed_receipts",
+                     receipts=[receipt_data.get("receipt_number") for receipt_data in missing])
+        self.ledger.set_mark(MARK, _iso(until))
+        with self._lock:
+            self._stats["polls"] += 1
+            self._stats["found"] += len(missing)
+            self._stats["last_poll"] = _iso(datetime.now(timezone.utc))
+        return len(missing)
+
+    def is_open(self, moment):
+        if not self.open_hours:
+            return True
+        for when in (moment, moment - timedelta(seconds=self.tail)):
+            minute = when.hour * 60 + when.minute
+            for start, end in self.open_hours:
+                if start <= end and start <= minute < end:
+                    return True
+                if start > end and (minute >= start or minute < end):
+                    return True
+        return False
+
+    # Seconds until the next poll: soon while open or right after finding
+    # missed receipts, otherwise up to closed_interval but no later than opening
+    def interval(self, moment, found=0):
+        if found or self.is_open(moment):
+            return self.open_interval
+        seconds_into_minute = moment.second + moment.microsecond / 1e6
+        minute = moment.hour * 60 + moment.minute
+        until_open = min(((start - minute) % 1440) * 60 - seconds_into_minute for start, _ in self.open_hours)
+        return max(self.open_interval, min(self.closed_interval, until_open))
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "enabled": self._pid == os.getpid(),
+                "high_water": self.ledger.get_mark(MARK),
+                "open": self.is_open(datetime.now()),
+            }
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from structured_log import get_logger
+
+log = get_logger("reference_data")
+
+# Names for the ids on a receipt (employee, store, payment type), so receipts
+# show "Aisha" instead of a UUID. Every table is fetched in bulk from Loyverse
+# up front and refreshed in the background every `ttl` seconds, so a render
+# only ever reads a dict. An id that is not there yet (e.g. a new employee)
+# is fetched on its own, once, however many renders ask at the same time;
+# ids Loyverse does not know are remembered for `miss_ttl` seconds. If
+# Loyverse cannot be reached the last good tables stay in use, and unknown
+# ids fall back to the raw id.
+KINDS = {
+    # kind: (list path and response key, item path)
+    "employees": ("employees", "employees/{}"),
+    "stores": ("stores", "stores/{}"),
+    "payment_types": ("payment_types", "payment_types/{}"),
+}
+
+class ReferenceData:
+    def __init__(self, loyverse, ttl=3600, miss_ttl=300, retry_interval=60):
+        self.loyverse = loyverse
+        self.ttl = ttl                        # seconds between bulk refreshes
+        self.miss_ttl = miss_ttl              # seconds an unknown id is not asked for again
+        self.retry_interval = retry_interval  # seconds before retrying a failed refresh
+        self._tables = {kind: {} for kind in KINDS}
+        self._misses = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {"refreshes": 0, "refresh_failures": 0, "fetches": 0, "misses": 0, "refreshed_at": None}
+
+    # Fetch every table now; returns False if any could not be loaded
+    def refresh(self):
+        ok = True
+        for kind, (path, _) in KINDS.items():
+            try:
+                table = {item["id"]: item.get("name") for item in self.loyverse.paginate(path, path) if item.get("id")}
+            except Exception as e:
+                ok = False
+                log.warning("reference_refresh_failed", kind=kind, error=str(e))
+                continue
+            # Swapped in whole, so readers never see a half-built table
+            with self._lock:
+                self._tables = {**self._tables, kind: table}
+        with self._lock:
+            self._stats["refreshes" if ok else "refresh_failures"] += 1
+            if ok:
+                self._stats["refreshed_at"] = time.time()
+                self._misses.clear()
+        return ok
+
+    # Refresh in the background (once per process); the first refresh runs
+    # straight away, so the cache is warm before the first sale
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+        threading.Thread(target=self._run, name="reference-data", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            interval = self.ttl if self.refresh() else self.retry_interval
+            if self._stop.wait(interval):
+                return
+
+    # Name for an id, read from memory; a miss is fetched once (single flight)
+    def name(self, kind, item_id, default=None):
+        if not item_id:
+            return default
+        name = self._tables[kind].get(item_id)
+        if name is not None:
+            return name
+        return self._fetch(kind, item_id) or default
+
+    def _fetch(self, kind, item_id):
+        key = (kind, item_id)
+        with self._lock:
+            missed_at = self._misses.get(key)
+            if missed_at is not None and time.monotonic() - missed_at < self.miss_ttl:
+                return None
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        name = None
+        try:
+            item = self.loyverse.get(KINDS[kind][1].format(item_id))
+            name = item.get("name")
+        except Exception as e:
+            log.warning("reference_fetch_failed", kind=kind, id=item_id, error=str(e))
+        with self._lock:
+            self._stats["fetches"] += 1
+            if name is None:
+                self._stats["misses"] += 1
+                self._misses[key] = time.monotonic()
+            else:
+                self._tables = {**self._tables, kind: {**self._tables[kind], item_id: name}}
+            del self._inflight[key]
+        future.set_result(name)
+        return name
+
+    # Copy of a receipt with employee_name, store_name and any missing payment
+    # names filled in, for the renderers to print
+    def annotate(self, receipt_data):
+        annotated = dict(receipt_data)
+        annotated["employee_name"] = self.name("employees", receipt_data.get("employee_id"))
+        annotated["store_name"] = self.name("stores", receipt_data.get("store_id"))
+        payments = receipt_data.get("payments")
+        if payments:
+            annotated["payments"] = [
+                payment if payment.get("name") else
+                {**payment, "name": self.name("payment_types", payment.get("payment_type_id"), "Payment")}
+                for payment in payments
+            ]
+        return annotated
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, **{kind: len(table) for kind, table in self._tables.items()}}
@@ -0,0 +1,159 @@
+import os
+import shutil
+import threading
+
+# Receipt renderers behind one interface, selected by name (RECEIPT_RENDERER):
+#   wkhtmltoimage  template HTML through imgkit; whole page, so the encoder crops
+#   pyppeteer      template HTML in a pooled headless Chromium, clipped to .receipt
+#   node           template HTML through a long-running screenshot.js (Node puppeteer)
+#   native         Pillow drawing from native_renderer, no HTML at all
+# A render is two stages, build (receipt data -> HTML or layout) and
+# rasterize (-> PNG bytes or a Pillow image), so callers can time them apart.
+# Each backend imports its dependencies when it is created, so a worker only
+# loads imgkit, pyppeteer or Pillow text rendering for the backend in use.
+CHROMIUM_PATH = os.getenv("CHROMIUM_PATH", "/usr/bin/chromium-browser")
+PAGE_POOL_SIZE = int(os.getenv("PAGE_POOL_SIZE", "2"))
+PAGE_MAX_RENDERS = int(os.getenv("PAGE_MAX_RENDERS", "100"))  # Recycle a page after this many renders
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "60"))  # Seconds a browser launch or render may take
+SCREENSHOT_SCRIPT = os.getenv(
+    "SCREENSHOT_SCRIPT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "screenshot.js")
+)
+# Card plus the body padding, so no blank width is rasterised
+WKHTMLTOIMAGE_WIDTH = int(os.getenv("WKHTMLTOIMAGE_WIDTH", "440"))
+WKHTMLTOIMAGE_ZOOM = float(os.getenv("WKHTMLTOIMAGE_ZOOM", "1"))  # e.g. 1.5 for a sharper image
+
+BACKENDS = {}
+
+def register(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+def create_renderer(name, template=None):
+    cls = BACKENDS.get(name)
+    if cls is None:
+        raise ValueError(f"Unknown receipt renderer {name!r}; choose from {', '.join(sorted(BACKENDS))}")
+    return cls(template)
+
+class Renderer:
+    name = None
+    # True when the image is the whole page rather than just the receipt card
+    crops = False
+
+    def __init__(self, template=None):
+        self.template = template
+
+    # server_time is the time printed on the receipt (default: now)
+    def build(self, receipt_data, server_time=None):
+        return self.template.render(receipt_data, server_time=server_time)
+
+    def rasterize(self, built):
+        raise NotImplementedError
+
+    def render(self, receipt_data, server_time=None):
+        return self.rasterize(self.build(receipt_data, server_time))
+
+    # Launch whatever the backend keeps running (browser, ...); no-op by default
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.name}
+
+@register("wkhtmltoimage")
+class WkhtmltoimageRenderer(Renderer):
+    crops = True
+
+    def __init__(self, template=None):
+        super().__init__(template)
+        import imgkit
+        if shutil.which("wkhtmltoimage") is None:
+            raise RuntimeError("wkhtmltoimage not installed")
+        self._imgkit = imgkit
+
+    # HTML goes through wkhtmltoimage's stdin/stdout; nothing touches the disk.
+    # The height follows the content.
+    def rasterize(self, built):
+        options = {"format": "png", "width": WKHTMLTOIMAGE_WIDTH}
+        if WKHTMLTOIMAGE_ZOOM != 1:
+            options["zoom"] = WKHTMLTOIMAGE_ZOOM
+        return self._imgkit.from_string(built, False, options=options)
+
+@register("pyppeteer")
+class PyppeteerRenderer(Renderer):
+    def __init__(self, template=None):
+        super().__init__(template)
+        from loop_thread import LoopThread
+        from page_pool import PagePool
+        self._page_pool = PagePool
+        self._loop = LoopThread("pyppeteer")
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # The page pool lives on the shared loop thread, where every render thread
+    # submits its screenshot, so up to PAGE_POOL_SIZE renders run at once.
+    # A forked worker gets its own loop and browser.
+    def _get_pool(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = self._page_pool(executable_path=CHROMIUM_PATH, size=PAGE_POOL_SIZE,
+                                             max_renders=PAGE_MAX_RENDERS)
+                self._pid = os.getpid()
+            return self._pool
+
+    def start(self):
+        self._loop.run(self._get_pool().start(), timeout=RENDER_TIMEOUT)
+
+    def rasterize(self, built):
+        # A render stuck behind a dead browser gives up instead of holding the worker
+        return self._loop.run(self._get_pool().screenshot(built, selector=".receipt"), timeout=RENDER_TIMEOUT)
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._loop.run(self._pool.close(), timeout=RENDER_TIMEOUT)
+
+    def stats(self):
+        return {"backend": self.name, **(self._pool.stats() if self._pool is not None else {})}
+
+@register("node")
+class NodeRenderer(Renderer):
+    def __init__(self, template=None):
+        super().__init__(template)
+        if shutil.which("node") is None:
+            raise RuntimeError("node not installed")
+        from screenshot_daemon import ScreenshotDaemon
+        self._daemon = ScreenshotDaemon(SCREENSHOT_SCRIPT, pool_size=PAGE_POOL_SIZE, max_renders=PAGE_MAX_RENDERS,
+                                        timeout=RENDER_TIMEOUT)
+
+    # screenshot.js runs as a daemon with a warm browser; HTML goes over its stdin
+    def start(self):
+        self._daemon.start()
+
+    def rasterize(self, built):
+        return self._daemon.render(built, selector=".receipt")
+
+    def close(self):
+        self._daemon.close()
+
+    def stats(self):
+        return {"backend": self.name, **self._daemon.stats()}
+
+@register("native")
+class NativeRenderer(Renderer):
+    def __init__(self, template=None):
+        super().__init__(template)
+        import native_renderer
+        self._native = native_renderer
+
+    def build(self, receipt_data, server_time=None):
+        return self._native.build_layout(receipt_data, self._native.NATIVE_RENDER_SCALE, server_time)
+
+    # Hands the Pillow image straight to the encoder, skipping a PNG round trip
+    def rasterize(self, built):
+        return self._native.draw(built)
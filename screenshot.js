@@ -1,30 +1,214 @@
 const puppeteer = require('puppeteer');
 const fs = require('fs');
+const readline = require('readline');
 
-(async () => {
-    const htmlFile = process.argv[2]; // HTML file path
-    const imgFile = process.argv[3];  // Output image file path
+// Two ways to run:
+//   node screenshot.js <htmlFile> <imgFile>   render one file and exit
+//   node screenshot.js --serve                long-running renderer
+// With --serve the browser is launched once and a pool of pages is kept warm.
+// Jobs arrive on stdin and results leave on stdout, one JSON object per line:
+//   in:  {"id": 1, "html": "<!DOCTYPE html>...", "selector": ".receipt"}
+//   out: {"id": 1, "ok": true, "image": "<base64 PNG>"}  or  {"id": 1, "ok": false, "error": "..."}
+// A {"ready": true} line is written once the browser is up. Jobs run
+// concurrently, up to PAGE_POOL_SIZE at a time, and replies can arrive out of
+// order. A page is replaced after PAGE_MAX_RENDERS renders, and the browser is
+// relaunched if it crashes. The daemon exits when stdin closes.
+const POOL_SIZE = parseInt(process.env.PAGE_POOL_SIZE || '2', 10);
+const MAX_RENDERS = parseInt(process.env.PAGE_MAX_RENDERS || '100', 10);
+const LAUNCH_OPTIONS = {
+    headless: "new",
+    args: ['--no-sandbox', '--disable-setuid-sandbox']
+};
 
-    if (!htmlFile || !imgFile) {
-        console.error("Usage: node screenshot.js <htmlFile> <imgFile>");
-        process.exit(1);
+// Capture just the receipt card, so the image is exactly as tall as its content.
+// 'load' covers the logo and stylesheets; networkidle0 would add a 500 ms idle
+// wait to every render. Web fonts can still be loading, so wait for those too.
+async function capture(page, html, selector, path) {
+    await page.setContent(html, { waitUntil: 'load' });
+    await page.evaluate(() => document.fonts.ready.then(() => true));
+    const element = selector ? await page.$(selector) : null;
+    const options = path ? { path } : {};
+    if (element) {
+        return element.screenshot(options);
     }
+    return page.screenshot({ ...options, fullPage: true });
+}
 
-    // Read HTML content
+async function renderFile(htmlFile, imgFile) {
     const htmlContent = fs.readFileSync(htmlFile, 'utf8');
+    const browser = await puppeteer.launch(LAUNCH_OPTIONS);
+    try {
+        const page = await browser.newPage();
+        await capture(page, htmlContent, '.receipt', imgFile);
+    } finally {
+        await browser.close();
+    }
+}
+
+// Pages of one browser, handed out to at most `size` jobs at a time
+class PagePool {
+    constructor(size, maxRenders) {
+        this.maxRenders = maxRenders;
+        this.slots = size;
+        this.waiting = [];
+        this.idle = [];
+        this.uses = new Map();
+        this.browser = null;
+        this.launching = null;
+    }
+
+    async ready() {
+        if (this.browser && this.browser.isConnected()) {
+            return this.browser;
+        }
+        if (!this.launching) {
+            this.launching = puppeteer.launch(LAUNCH_OPTIONS).then(browser => {
+                this.idle = [];
+                this.uses.clear();
+                this.browser = browser;
+                browser.on('disconnected', () => {
+                    if (this.browser === browser) {
+                        console.error('screenshot.js: browser disconnected, relaunching on next job');
+                        this.browser = null;
+                    }
+                });
+                return browser;
+            }).finally(() => {
+                this.launching = null;
+            });
+        }
+        return this.launching;
+    }
+
+    take() {
+        if (this.slots > 0) {
+            this.slots--;
+            return Promise.resolve();
+        }
+        return new Promise(resolve => this.waiting.push(resolve));
+    }
+
+    give() {
+        const next = this.waiting.shift();
+        if (next) {
+            next();
+        } else {
+            this.slots++;
+        }
+    }
+
+    async page() {
+        const browser = await this.ready();
+        while (this.idle.length) {
+            const page = this.idle.pop();
+            if (this.uses.has(page)) {
+                return page;
+            }
+        }
+        const page = await browser.newPage();
+        this.uses.set(page, 0);
+        return page;
+    }
+
+    // Blank the page for the next job, or drop it after a failure or too many uses
+    async recycle(page, failed) {
+        if (!page || !this.uses.has(page)) {
+            return;  // belonged to a browser that has since been relaunched
+        }
+        const uses = this.uses.get(page) + 1;
+        if (failed || uses >= this.maxRenders) {
+            this.uses.delete(page);
+            await page.close().catch(() => {});
+            return;
+        }
+        try {
+            await page.goto('about:blank');
+            this.uses.set(page, uses);
+            this.idle.push(page);
+        } catch (e) {
+            this.uses.delete(page);
+        }
+    }
+
+    async run(job) {
+        await this.take();
+        let page = null;
+        let failed = false;
+        try {
+            page = await this.page();
+            return await job(page);
+        } catch (e) {
+            failed = true;
+            throw e;
+        } finally {
+            await this.recycle(page, failed);
+            this.give();
+        }
+    }
+
+    async close() {
+        if (this.browser) {
+            await this.browser.close().catch(() => {});
+            this.browser = null;
+        }
+    }
+}
+
+function reply(message) {
+    process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+async function handle(pool, line) {
+    let job;
+    try {
+        job = JSON.parse(line);
+    } catch (e) {
+        reply({ ok: false, error: `invalid job: ${e.message}` });
+        return;
+    }
+    try {
+        const image = await pool.run(page => capture(page, job.html, job.selector || '.receipt'));
+        reply({ id: job.id, ok: true, image: Buffer.from(image).toString('base64') });
+    } catch (e) {
+        reply({ id: job.id, ok: false, error: String((e && e.message) || e) });
+    }
+}
+
+async function serve() {
+    const pool = new PagePool(POOL_SIZE, MAX_RENDERS);
+    try {
+        await pool.ready();
+    } catch (e) {
+        reply({ ready: false, error: String((e && e.message) || e) });
+        process.exit(1);
+    }
+    reply({ ready: true });
 
-    // Launch Puppeteer
-    const browser = await puppeteer.launch({
-        headless: "new",
-        args: ['--no-sandbox', '--disable-setuid-sandbox']
+    const input = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+    input.on('line', line => {
+        if (line.trim()) {
+            handle(pool, line);
+        }
     });
-    const page = await browser.newPage();
+    input.on('close', async () => {
+        await pool.close();
+        process.exit(0);
+    });
+}
 
-    // Set content
-    await page.setContent(htmlContent, { waitUntil: 'networkidle0' });
+(async () => {
+    if (process.argv[2] === '--serve') {
+        await serve();
+        return;
+    }
 
-    // Capture screenshot
-    await page.screenshot({ path: imgFile, fullPage: true });
+    const htmlFile = process.argv[2]; // HTML file path
+    const imgFile = process.argv[3];  // Output image file path
+
+    if (!htmlFile || !imgFile) {
+        console.error("Usage: node screenshot.js <htmlFile> <imgFile>  |  node screenshot.js --serve");
+        process.exit(1);
+    }
 
-    await browser.close();
+    await renderFile(htmlFile, imgFile);
 })();
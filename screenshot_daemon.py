@@ -0,0 +1,145 @@
+import base64
+import itertools
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import Future
+from structured_log import get_logger
+
+log = get_logger("screenshot_daemon")
+
+# Client for `node screenshot.js --serve`: one long-running Node process per
+# worker with a warm browser and page pool, so a render costs a setContent and
+# a screenshot instead of Node startup plus a browser launch. Jobs are written
+# to the daemon's stdin as JSON lines and matched to replies by id on a reader
+# thread, so several render threads can share the daemon. A daemon that dies
+# is restarted on the next render; a forked worker starts its own.
+class ScreenshotDaemon:
+    def __init__(self, script, node="node", pool_size=2, max_renders=100, timeout=60, start_timeout=60):
+        self.script = script
+        self.node = node
+        self.pool_size = pool_size      # pages rendering at once inside the daemon
+        self.max_renders = max_renders  # renders before a page is replaced
+        self.timeout = timeout          # seconds to wait for one render
+        self.start_timeout = start_timeout
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._process = None
+        self._ready = None
+        self._pending = None
+        self._pid = None
+        self._counts = {"renders": 0, "failed": 0, "restarts": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    # Running daemon for this process: (process, ready future, pending replies)
+    def _ensure(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._process.poll() is None:
+                return self._process, self._ready, self._pending
+            if self._pid == os.getpid():
+                self._counts["restarts"] += 1
+                log.warning("screenshot_daemon_restart", exit_code=self._process.returncode)
+            env = {**os.environ, "PAGE_POOL_SIZE": str(self.pool_size), "PAGE_MAX_RENDERS": str(self.max_renders)}
+            process = subprocess.Popen(
+                [self.node, self.script, "--serve"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+            )
+            ready, pending = Future(), {}
+            threading.Thread(target=self._read, args=(process, ready, pending),
+                             name="screenshot-daemon", daemon=True).start()
+            self._process, self._ready, self._pending = process, ready, pending
+            self._pid = os.getpid()
+            return process, ready, pending
+
+    # Reader thread: resolve each job's future from its reply line
+    def _read(self, process, ready, pending):
+        for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                log.warning("screenshot_daemon_bad_reply", line=line)
+                continue
+            if "id" not in message:
+                if "ready" in message and not ready.done():
+                    if message["ready"]:
+                        ready.set_result(True)
+                    else:
+                        ready.set_exception(RuntimeError(f"screenshot daemon failed to start: {message.get('error')}"))
+                elif not message.get("ok", True):
+                    log.warning("screenshot_daemon_error", error=message.get("error"))
+                continue
+            with self._lock:
+                future = pending.pop(message["id"], None)
+            if future is None:
+                continue  # timed out already
+            if message.get("ok"):
+                future.set_result(base64.b64decode(message["image"]))
+            else:
+                future.set_exception(RuntimeError(message.get("error") or "render failed"))
+
+        # stdout closed: the daemon has exited, so nothing pending will be answered
+        code = process.wait()
+        error = RuntimeError(f"screenshot daemon exited with code {code}")
+        if not ready.done():
+            ready.set_exception(error)
+        with self._lock:
+            futures = list(pending.values())
+            pending.clear()
+        for future in futures:
+            future.set_exception(error)
+
+    # Launch the daemon and wait until its browser is up
+    def start(self):
+        _, ready, _ = self._ensure()
+        ready.result(self.start_timeout)
+
+    # Render an HTML string and return PNG bytes of the element matching selector
+    # (the whole page if there is none)
+    def render(self, html, selector=".receipt"):
+        process, ready, pending = self._ensure()
+        ready.result(self.start_timeout)
+        job_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            pending[job_id] = future
+        line = json.dumps({"id": job_id, "html": html, "selector": selector}).encode() + b"\n"
+        try:
+            with self._write_lock:
+                process.stdin.write(line)
+                process.stdin.flush()
+            image = future.result(self.timeout)
+        except Exception:
+            with self._lock:
+                pending.pop(job_id, None)
+            self._count("failed")
+            raise
+        self._count("renders")
+        return image
+
+    def close(self):
+        with self._lock:
+            process = self._process if self._pid == os.getpid() else None
+            self._process, self._pid = None, None
+        if process is None:
+            return
+        # Closing stdin tells the daemon to shut its browser down and exit
+        try:
+            process.stdin.close()
+            process.wait(10)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+
+    def stats(self):
+        with self._lock:
+            running = self._pid == os.getpid() and self._process.poll() is None
+            return {
+                **self._counts,
+                "running": running,
+                "pending": len(self._pending) if running else 0,
+                "pool_size": self.pool_size,
+            }
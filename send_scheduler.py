@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Rate-limited front for the Telegram client. Telegram allows a bot about
+# 20 messages a minute in one group and about 30 a second overall, and
+# answers anything faster with 429s and growing penalties. Sends are queued
+# per chat and a single dispatcher hands them to the upload pool only when
+# both the chat's token bucket and the bot-wide bucket have a token, taking
+# chats round-robin so one busy chat cannot starve the others. A 429 that
+# still slips through empties the chat's bucket for the retry_after period.
+# With album_window set, photos queued for the same chat are coalesced into
+# sendMediaGroup albums of up to ALBUM_SIZE images: the first photo waits up
+# to album_window seconds for company. An album costs a token per photo,
+# since Telegram counts each photo in it as a message.
+# Limits are per process; with several gunicorn workers each one gets an
+# equal share (see WEB_CONCURRENCY).
+CHAT_RATE = 20 / 60  # messages per second to a single group
+GLOBAL_RATE = 30     # messages per second for the whole bot
+ALBUM_SIZE = 10      # Telegram's limit for one media group
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate          # tokens added per second
+        self.capacity = capacity  # largest burst
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `count` tokens are available (0 if they are now). More than
+    # the capacity can never build up, so a larger count waits for a full
+    # bucket and take() leaves it in debt for the rest.
+    def delay(self, now, count=1):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        needed = min(count, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, now, count=1):
+        self._refill(now)
+        self.tokens -= count
+
+    # No tokens until `seconds` from now, e.g. after a 429
+    def block(self, now, seconds):
+        self._refill(now)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class SendScheduler:
+    def __init__(self, client, chat_rate=CHAT_RATE, chat_burst=1, global_rate=GLOBAL_RATE,
+                 global_burst=None, workers=None, album_window=None):
+        self.client = client
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers or client.pool_size
+        self.album_window = album_window  # seconds to collect an album; None sends photos one by one
+        self._global = TokenBucket(global_rate, global_burst or max(1, int(global_rate)))
+        self._buckets = {}
+        self._queues = OrderedDict()  # chat_id -> deque of pending sends, in round-robin order
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._pid = None
+        self._counts = {"queued": 0, "dispatched": 0, "albums": 0, "rate_limited": 0}
+        self._max_wait = 0.0
+        client.on_rate_limit = self._rate_limited
+
+    # Dispatcher and upload pool are per process, restarted after a fork
+    def _start(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._queues.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="send")
+        self._thread = threading.Thread(target=self._dispatch, name="send-scheduler", daemon=True)
+        self._pid = os.getpid()
+        self._thread.start()
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # Queue a call to client.<method>(chat_id, ...); returns a Future with its result
+    def submit(self, method, chat_id, *args, **kwargs):
+        future = Future()
+        with self._cond:
+            self._start()
+            self._queues.setdefault(chat_id, deque()).append(
+                (time.monotonic(), future, method, chat_id, args, kwargs)
+            )
+            self._counts["queued"] += 1
+            self._cond.notify()
+        return future
+
+    def send_photo(self, chat_id, image, **kwargs):
+        return self.submit("send_photo", chat_id, image, **kwargs).result()
+
+    # Leading run of photos in a chat's queue that can go out as one album
+    def _album(self, pending):
+        album = []
+        for job in pending:
+            if job[2] != "send_photo" or len(album) == ALBUM_SIZE:
+                break
+            album.append(job)
+        return album
+
+    # Next send allowed right now, or the number of seconds to wait for one
+    def _next(self, now):
+        if not self._queues:
+            return None, None
+        wait = self._global.delay(now)
+        if wait > 0:
+            return None, wait
+        for chat_id, pending in self._queues.items():
+            bucket = self._bucket(chat_id)
+            album = self._album(pending) if self.album_window is not None else []
+            count = len(album) if len(album) > 1 else 1
+            # Every photo of an album counts against both limits
+            delay = max(bucket.delay(now, count), self._global.delay(now, count))
+            if album and len(album) < ALBUM_SIZE:
+                # Hold the first photo until the window closes or the album is full
+                delay = max(delay, album[0][0] + self.album_window - now)
+            if delay > 0:
+                wait = delay if wait == 0 else min(wait, delay)
+                continue
+            bucket.take(now, count)
+            self._global.take(now, count)
+            jobs = [pending.popleft() for _ in range(count)]
+            # Served chats go to the back of the line
+            del self._queues[chat_id]
+            if pending:
+                self._queues[chat_id] = pending
+            return jobs, None
+        return None, wait
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                jobs, wait = self._next(time.monotonic())
+                if jobs is None:
+                    self._cond.wait(wait)
+                    continue
+                self._counts["queued"] -= len(jobs)
+                self._counts["dispatched"] += len(jobs)
+                if len(jobs) > 1:
+                    self._counts["albums"] += 1
+                self._max_wait = max(self._max_wait, time.monotonic() - jobs[0][0])
+            self._executor.submit(self._run if len(jobs) == 1 else self._run_album, *jobs)
+
+    def _run(self, job):
+        _, future, method, chat_id, args, kwargs = job
+        try:
+            future.set_result(getattr(self.client, method)(chat_id, *args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+    # Send queued photos as one album; each caller gets its own message back
+    def _run_album(self, *jobs):
+        chat_id = jobs[0][3]
+        images = [job[4][0] for job in jobs]
+        captions = [job[5].get("caption") for job in jobs]
+        try:
+            messages = self.client.send_media_group(chat_id, images, captions,
+                                                    mime=jobs[0][5].get("mime", "image/png"))
+        except Exception as e:
+            for job in jobs:
+                job[1].set_exception(e)
+            return
+        for i, job in enumerate(jobs):
+            job[1].set_result(messages[i] if messages and i < len(messages) else None)
+
+    # Called by the client on a 429: hold the chat back for retry_after seconds
+    def _rate_limited(self, chat_id, retry_after):
+        with self._cond:
+            self._counts["rate_limited"] += 1
+            self._bucket(chat_id).block(time.monotonic(), retry_after)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats["chats_waiting"] = len(self._queues)
+            stats["max_wait_ms"] = round(self._max_wait * 1000, 1)
+        return stats
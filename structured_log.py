@@ -0,0 +1,185 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# JSON-lines logging that never blocks a request. Records go onto a bounded
+# in-memory queue and a background listener thread formats and writes them,
+# so a slow stdout (or gunicorn's log pipe) cannot stall a webhook; when the
+# queue is full the record is dropped and counted instead of waiting.
+# Every line is one JSON object: ts, level, logger, event, plus the event's
+# fields, which are
+#   redacted   - secrets and personal data by key, Telegram bot tokens anywhere
+#   truncated  - long strings, long lists and deep nesting are cut short
+#   sampled    - high-volume events (e.g. full webhook payloads) can be logged
+#                for only a fraction of calls with sample=<rate>
+# Configured from the environment on first use:
+#   LOG_LEVEL (INFO), LOG_QUEUE_SIZE (10000), LOG_MAX_STRING (500 characters),
+#   LOG_MAX_ITEMS (20 list items)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_STRING = int(os.getenv("LOG_MAX_STRING", "500"))
+LOG_MAX_ITEMS = int(os.getenv("LOG_MAX_ITEMS", "20"))
+MAX_DEPTH = 6
+
+REDACT_KEYS = {
+    "token", "access_token", "bot_token", "authorization", "password", "secret", "api_key",
+    "email", "phone", "phone_number",
+    # Loyverse receipt fields that identify or describe a customer
+    "customer_id", "note",
+}
+# Any key starting with one of these (points_earned, points_deducted, points_balance)
+REDACT_PREFIXES = ("points_",)
+_BOT_TOKEN = re.compile(r"bot\d+:[A-Za-z0-9_-]{20,}")
+_BEARER = re.compile(r"(Bearer\s+)[A-Za-z0-9._-]+")
+
+def _redacted(key):
+    key = str(key).lower()
+    return key in REDACT_KEYS or key.startswith(REDACT_PREFIXES)
+
+def _redact_text(text):
+    return _BEARER.sub(r"\1[redacted]", _BOT_TOKEN.sub("bot[redacted]", text))
+
+# Copy of value that is safe and small enough to log
+def clean(value, depth=0):
+    if isinstance(value, str):
+        value = _redact_text(value)
+        if len(value) > LOG_MAX_STRING:
+            return f"{value[:LOG_MAX_STRING]}...(+{len(value) - LOG_MAX_STRING} chars)"
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if depth >= MAX_DEPTH:
+        return "...(nested too deep)"
+    if isinstance(value, dict):
+        return {
+            str(key): "[redacted]" if _redacted(key) else clean(item, depth + 1)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple, set)):
+        items = [clean(item, depth + 1) for item in list(value)[:LOG_MAX_ITEMS]]
+        if len(value) > LOG_MAX_ITEMS:
+            items.append(f"...(+{len(value) - LOG_MAX_ITEMS} items)")
+        return items
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return clean(str(value), depth)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            "pid": record.process,
+        }
+        entry.update(clean(getattr(record, "fields", {})))
+        if record.exc_info:
+            entry["exception"] = clean(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# QueueHandler that drops instead of blocking, and starts its listener in
+# whichever process first logs (so it survives a gunicorn fork)
+class _DroppingQueueHandler(QueueHandler):
+    def __init__(self, handler, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.target = handler
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(self.queue.maxsize)
+                self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Formatting, redaction and truncation happen on the listener thread, not
+    # the caller's; fields are passed by reference, so log values that are not
+    # changed afterwards
+    def prepare(self, record):
+        return record
+
+    def flush(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+_handler = None
+_configure_lock = threading.Lock()
+
+def _configure():
+    global _handler
+    with _configure_lock:
+        if _handler is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        _handler = _DroppingQueueHandler(stream, LOG_QUEUE_SIZE)
+        root = logging.getLogger("receipts")
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        atexit.register(flush)
+
+# Logger taking an event name plus keyword fields:
+#   log.info("webhook_received", sample=0.1, payload=data)
+class StructuredLogger:
+    def __init__(self, name):
+        _configure()
+        self._logger = logging.getLogger(f"receipts.{name}")
+
+    def log(self, level, event, sample=None, exc_info=False, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample is not None and random.random() >= sample:
+            return
+        if sample is not None:
+            fields["sample_rate"] = sample
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+def get_logger(name):
+    return StructuredLogger(name)
+
+# Records dropped because the queue was full, for monitoring
+def dropped():
+    return _handler.dropped if _handler is not None else 0
+
+# Write out everything still queued (e.g. before exiting)
+def flush():
+    if _handler is not None:
+        _handler.flush()
@@ -0,0 +1,164 @@
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from structured_log import get_logger
+
+log = get_logger("telegram_client")
+
+# Bot API client shared by every upload: one pooled, kept-alive session per
+# process instead of a fresh TLS handshake per receipt, bounded retries with
+# jittered backoff on network errors and 5xx, and Telegram's own retry_after
+# honoured on 429. Failures are counted and returned, not just printed.
+API_URL = "https://api.telegram.org"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+EXTENSIONS = {"image/png": "png", "image/webp": "webp", "image/jpeg": "jpg"}
+
+class TelegramClient:
+    def __init__(self, token, pool_size=8, max_retries=4, backoff=0.5, max_backoff=30.0,
+                 timeout=(5, 30)):
+        self.token = token
+        self.pool_size = pool_size      # kept-alive connections, and concurrent uploads
+        self.max_retries = max_retries  # attempts after the first one
+        self.backoff = backoff          # seconds, doubled per attempt before jitter
+        self.max_backoff = max_backoff
+        self.timeout = timeout          # (connect, read) seconds
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._counts = {"sent": 0, "failed": 0, "retries": 0, "rate_limited": 0}
+        self.on_rate_limit = None  # optional callback(chat_id, retry_after) on every 429
+        self.on_request = None     # optional callback(method, seconds, status) per HTTP attempt
+
+    # Session is per process, recreated after a gunicorn fork
+    def _setup(self):
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                self._session = session
+                self._pid = os.getpid()
+            return self._session
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counts[key] += amount
+
+    def _observe(self, method, started, status):
+        if self.on_request is not None:
+            self.on_request(method, time.perf_counter() - started, status)
+
+    # Seconds to wait before the given retry (0-based), with full jitter
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    # Call a Bot API method, retrying transient failures. Returns the
+    # decoded "result" on success and None once the retries are used up.
+    def call(self, method, data=None, files=None):
+        session = self._setup()
+        url = f"{API_URL}/bot{self.token}/{method}"
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            started = time.perf_counter()
+            try:
+                response = session.post(url, data=data, files=files, timeout=self.timeout)
+            except requests.RequestException as e:
+                self._observe(method, started, "error")
+                log.warning("telegram_request_failed", method=method, attempt=attempt + 1, error=str(e))
+                if last:
+                    break
+                self._count("retries")
+                time.sleep(self._delay(attempt))
+                continue
+
+            self._observe(method, started, response.status_code)
+            if response.status_code == 200:
+                self._count("sent")
+                return response.json().get("result")
+
+            log.warning("telegram_request_failed", method=method, attempt=attempt + 1,
+                        status=response.status_code, body=response.text)
+            if response.status_code not in RETRY_STATUSES or last:
+                break
+            self._count("retries")
+            if response.status_code == 429:
+                self._count("rate_limited")
+                retry_after = _retry_after(response)
+                if self.on_rate_limit is not None:
+                    self.on_rate_limit((data or {}).get("chat_id"), retry_after)
+                time.sleep(retry_after + random.uniform(0, self.backoff))
+            else:
+                time.sleep(self._delay(attempt))
+
+        self._count("failed")
+        return None
+
+    # One getMe, no retries, to resolve DNS and open a kept-alive TLS connection
+    # before the first upload (e.g. at worker start). True if Telegram answered.
+    def warm_up(self):
+        session = self._setup()
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{API_URL}/bot{self.token}/getMe", timeout=self.timeout)
+        except requests.RequestException as e:
+            self._observe("getMe", started, "error")
+            log.warning("telegram_warm_up_failed", error=str(e))
+            return False
+        self._observe("getMe", started, response.status_code)
+        return response.status_code == 200
+
+    # `image` is PNG bytes to upload, or the file_id of a photo Telegram already has
+    def send_photo(self, chat_id, image, caption=None, filename=None, mime="image/png"):
+        data = {"chat_id": chat_id}
+        if caption:
+            data["caption"] = caption
+        if isinstance(image, str):
+            data["photo"] = image
+            return self.call("sendPhoto", data=data)
+        filename = filename or f"receipt.{EXTENSIONS.get(mime, 'png')}"
+        return self.call("sendPhoto", data=data, files={"photo": (filename, image, mime)})
+
+    # One album of 2-10 photos; returns the list of sent messages, or None
+    def send_media_group(self, chat_id, images, captions=None, mime="image/png"):
+        captions = captions or [None] * len(images)
+        media, files = [], {}
+        for i, (image, caption) in enumerate(zip(images, captions)):
+            if isinstance(image, str):
+                item = {"type": "photo", "media": image}
+            else:
+                name = f"photo{i}"
+                files[name] = (f"receipt{i}.{EXTENSIONS.get(mime, 'png')}", image, mime)
+                item = {"type": "photo", "media": f"attach://{name}"}
+            if caption:
+                item["caption"] = caption
+            media.append(item)
+        return self.call("sendMediaGroup", data={"chat_id": chat_id, "media": json.dumps(media)}, files=files or None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+# Wait requested by a 429: parameters.retry_after in the body, else the header
+def _retry_after(response):
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        return 1.0
+
+
+# file_id of the largest size of a sent photo, to send it again without re-uploading
+def photo_file_id(message):
+    try:
+        return message["photo"][-1]["file_id"]
+    except (KeyError, IndexError, TypeError):
+        return None
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from structured_log import get_logger
+
+log = get_logger("warmup")
+
+# Worker warm-up: runs once per process in a background thread right after
+# the worker boots, so the first real receipt does not pay for cold imports,
+# the first browser/wkhtmltoimage launch, font loading or Telegram's DNS and
+# TLS handshake. Steps are (name, func, required); a step fails if it raises
+# or returns False. The worker is ready once every step has run and every
+# required one succeeded; optional steps (e.g. anything needing the network)
+# are reported but never hold readiness back. Required steps that fail are
+# run again, retry_delay seconds later and doubling up to max_retry_delay,
+# until they pass, so a worker that booted while Chromium or the disk was
+# unhappy becomes ready without a restart.
+class Warmup:
+    def __init__(self, steps, enabled=True, retry_delay=1.0, max_retry_delay=60.0):
+        self.steps = list(steps)
+        self.enabled = enabled
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._results = {}
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started_at = None
+        self._seconds = None
+        if not enabled:
+            self._done.set()
+
+    # Start warming up in the background (once per process)
+    def start(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._results = {}
+            self._done = threading.Event()
+            self._started_at = time.monotonic()
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+
+    def _step(self, name, func, required, attempts=1):
+        started = time.perf_counter()
+        result = {"required": required, "attempts": attempts}
+        try:
+            result["ok"] = func() is not False
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+            log.exception("warmup_step_failed", step=name, required=required, attempts=attempts)
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self._results[name] = result
+        return result["ok"]
+
+    def _run(self):
+        for name, func, required in self.steps:
+            self._step(name, func, required)
+        self._seconds = round(time.monotonic() - self._started_at, 3)
+        log.info("warmup_finished", ready=self.ready, seconds=self._seconds,
+                 failed=[name for name, result in self._results.items() if not result["ok"]])
+        self._done.set()
+
+        # Steps run in order, so a retry starts from the first failed required one
+        delay = self.retry_delay
+        attempts = 1
+        while not self.ready:
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            attempts += 1
+            with self._lock:
+                failed = {name for name, result in self._results.items() if result["required"] and not result["ok"]}
+            for name, func, required in self.steps:
+                if name in failed and not self._step(name, func, required, attempts):
+                    break
+        if attempts > 1:
+            log.info("warmup_recovered", seconds=round(time.monotonic() - self._started_at, 3), attempts=attempts)
+
+    @property
+    def ready(self):
+        if not self._done.is_set():
+            return False
+        with self._lock:
+            return all(result["ok"] for result in self._results.values() if result["required"])
+
+    # Block until warm-up has finished; True if it did within timeout
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            steps = {name: dict(result) for name, result in self._results.items()}
+        return {
+            "ready": self.ready,
+            "done": self._done.is_set(),
+            "enabled": self.enabled,
+            "seconds": self._seconds,
+            "steps": steps,
+        }